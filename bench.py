@@ -0,0 +1,238 @@
+"""转发链路的微基准测试
+
+用法：
+    python bench.py keywords    关键字引擎：规则数量增长时单条消息的处理耗时
+    python bench.py embeds      embed 标准化：旧的 to_dict/from_dict 流程与单遍分类的单条消息耗时
+                                （--fixtures 可指定录制的 MESSAGE_CREATE 数据，每行一个 JSON）
+    python bench.py memory      监听账号内存：默认配置（全部频道建模、消息/成员缓存）与受限配置的内存对比
+"""
+import argparse
+import json
+import random
+import string
+import time
+import tracemalloc
+from collections import deque
+from types import SimpleNamespace
+
+import discord
+
+from bot import KeywordEngine, normalize_model, normalize_payload
+
+
+def _random_word(rng, length):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def _timeit(func, messages, rounds=5):
+    """返回单条消息的平均耗时（微秒），取多轮中的最好成绩"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for message in messages:
+            func(message)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages) * 1e6
+
+
+def _naive(include, exclude, replace):
+    """旧实现：每个关键字扫描一遍，每条替换规则再做一次 str.replace"""
+    def run(content):
+        if include and not any(k in content for k in include):
+            return None
+        if any(k in content for k in exclude):
+            return None
+        for rule in replace:
+            content = content.replace(rule["from"], rule["to"])
+        return content
+    return run
+
+
+def bench_keywords(args):
+    rng = random.Random(42)
+    messages = [
+        " ".join(_random_word(rng, rng.randint(3, 9)) for _ in range(80)) + " important"
+        for _ in range(200)
+    ]
+    print(f"{'规则数':>8} {'旧实现 µs/条':>14} {'引擎 µs/条':>12} {'编译 ms':>9}")
+    for count in args.sizes:
+        exclude = [_random_word(rng, 12) for _ in range(count)]
+        replace = [{"from": _random_word(rng, 10), "to": "x"} for _ in range(count)]
+        include = ["important"]
+        start = time.perf_counter()
+        engine = KeywordEngine(include, exclude, replace)
+        compile_ms = (time.perf_counter() - start) * 1e3
+        naive_us = _timeit(_naive(include, exclude, replace), messages)
+        engine_us = _timeit(engine.process, messages)
+        print(f"{count:>8} {naive_us:>14.1f} {engine_us:>12.1f} {compile_ms:>9.1f}")
+
+
+EMBED_FIXTURES = [
+    # 行情播报：标题 + 描述 + 多个字段
+    {"content": "", "embeds": [{
+        "title": "BTC/USDT 价格提醒",
+        "description": "Price crossed the alert level",
+        "color": 16753920,
+        "fields": [{"name": name, "value": "123.45", "inline": True}
+                   for name in ("Price", "Volume", "Change", "High", "Low", "Open", "Close", "Market Cap")],
+        "footer": {"text": "alerts"},
+        "timestamp": "2025-08-12T22:41:12+00:00",
+    }]},
+    # 仅图片
+    {"content": "", "embeds": [{"image": {"url": "https://cdn.example.com/a.png", "width": 800, "height": 600}}]},
+    # 带文本的普通消息 + 链接预览
+    {"content": "new listing https://example.com", "embeds": [{
+        "title": "Example", "description": "Example domain", "url": "https://example.com",
+        "thumbnail": {"url": "https://example.com/t.png"},
+    }]},
+    # description 是 JSON 的嵌套型 embed
+    {"content": "", "embeds": [{
+        "description": json.dumps({"content": "hi", "embeds": [{"title": "inner"}]}),
+    }]},
+]
+
+
+def _old_normalize(message):
+    """旧实现：每个 embed 走一遍 to_dict/from_dict，再逐个探测嵌套 JSON，最后两次计算仅图片判定"""
+    raw_embed_dicts = []
+    converted = []
+    for e in message.embeds:
+        raw = e.to_dict()
+        raw_embed_dicts.append(raw)
+        converted.append(discord.Embed.from_dict(raw))
+    suspect_nested = False
+    for raw in raw_embed_dicts:
+        if any(k in raw for k in ("embeds", "message", "messages")):
+            suspect_nested = True
+            break
+        desc = raw.get("description")
+        if isinstance(desc, str) and (desc.strip().startswith("{") or desc.strip().startswith("[")):
+            try:
+                parsed = json.loads(desc)
+                if isinstance(parsed, dict) and any(k in parsed for k in ("embeds", "message", "messages", "content")):
+                    suspect_nested = True
+                    break
+            except Exception:
+                pass
+    for _ in range(2):  # on_message 与 forward_message 各算一次
+        only_image = bool(converted) and all(
+            (not getattr(e, 'title', None)) and (not getattr(e, 'description', None))
+            and (not getattr(e, 'fields', [])) and getattr(getattr(e, 'image', None), 'url', None)
+            for e in converted
+        )
+    return converted, suspect_nested, only_image
+
+
+def _new_normalize(message):
+    normalized = normalize_model(message)
+    return normalized.embeds, normalized.nested, normalized.image_only
+
+
+def _load_fixtures(path):
+    if not path:
+        return EMBED_FIXTURES
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def bench_embeds(args):
+    payloads = _load_fixtures(args.fixtures)
+    messages = [
+        SimpleNamespace(
+            content=p.get("content", ""),
+            embeds=[discord.Embed.from_dict(e) for e in p.get("embeds", [])],
+            attachments=[],
+            reference=None,
+            message_snapshots=None,
+        )
+        for p in payloads
+    ] * args.repeat
+    for message in messages[:len(payloads)]:
+        assert _old_normalize(message)[1:] == _new_normalize(message)[1:], "分类结果与旧实现不一致"
+    old_us = _timeit(_old_normalize, messages)
+    new_us = _timeit(_new_normalize, messages)
+    raw_us = _timeit(normalize_payload, payloads * args.repeat)
+    print(f"fixtures: {len(payloads)} 条, 每条 embed 平均 {sum(len(p.get('embeds', [])) for p in payloads) / len(payloads):.1f} 个")
+    print(f"旧流程 (to_dict/from_dict + 重复判定):  {old_us:8.1f} µs/条")
+    print(f"单遍分类 (Message 对象):               {new_us:8.1f} µs/条")
+    print(f"单遍分类 (网关原始数据):               {raw_us:8.1f} µs/条")
+
+
+def _gateway_events(rng, count, channels):
+    """模拟服务器内各频道的 MESSAGE_CREATE 事件"""
+    events = []
+    for i in range(count):
+        author_id = str(10 ** 17 + rng.randrange(count // 4 or 1))
+        payload = {
+            "id": str(10 ** 18 + i),
+            "channel_id": rng.choice(channels),
+            "content": " ".join(_random_word(rng, rng.randint(3, 9)) for _ in range(rng.randint(3, 30))),
+            "author": {"id": author_id, "username": _random_word(rng, 8), "avatar": _random_word(rng, 32)},
+            "member": {"roles": [str(rng.randrange(10 ** 18)) for _ in range(3)], "joined_at": "2025-01-01T00:00:00+00:00"},
+            "embeds": [],
+            "attachments": [],
+        }
+        if rng.random() < 0.3:
+            payload["embeds"] = [dict(EMBED_FIXTURES[0]["embeds"][0])]
+        events.append(payload)
+    return events
+
+
+def _ingest(events, mapped, max_messages, member_cache, drop_unmapped):
+    """按给定配置消费事件：构建模型、写入消息缓存与成员缓存，返回 (保留对象, 耗时)"""
+    messages = deque(maxlen=max_messages or 0)
+    members = {}
+    start = time.perf_counter()
+    for payload in events:
+        if drop_unmapped and payload["channel_id"] not in mapped:
+            continue
+        message = (payload, normalize_payload(payload))
+        if max_messages:
+            messages.append(message)
+        if member_cache:
+            members[payload["author"]["id"]] = dict(payload["author"], **payload["member"])
+    return (messages, members), time.perf_counter() - start
+
+
+def bench_memory(args):
+    rng = random.Random(42)
+    channels = [str(10 ** 18 + i * 4096) for i in range(args.channels)]
+    mapped = set(channels[:args.mapped])
+    events = _gateway_events(rng, args.events, channels)
+    profiles = [
+        ("默认配置", dict(max_messages=1000, member_cache=True, drop_unmapped=False)),
+        ("受限配置", dict(max_messages=args.max_messages, member_cache=False, drop_unmapped=True)),
+    ]
+    print(f"事件: {len(events)} 条, 频道: {args.channels} 个 (映射 {args.mapped} 个)")
+    print(f"{'配置':<8} {'常驻 KB':>10} {'峰值 KB':>10} {'µs/事件':>9}")
+    for name, options in profiles:
+        tracemalloc.start()
+        kept, elapsed = _ingest(events, mapped, **options)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:<8} {current / 1024:>10.0f} {peak / 1024:>10.0f} {elapsed / len(events) * 1e6:>9.1f}")
+        del kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转发链路微基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+    keywords = sub.add_parser("keywords", help="关键字过滤/替换")
+    keywords.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    keywords.set_defaults(func=bench_keywords)
+    embeds = sub.add_parser("embeds", help="embed 标准化")
+    embeds.add_argument("--fixtures", help="录制的 MESSAGE_CREATE 数据文件（JSON Lines）")
+    embeds.add_argument("--repeat", type=int, default=250)
+    embeds.set_defaults(func=bench_embeds)
+    memory = sub.add_parser("memory", help="监听账号内存配置")
+    memory.add_argument("--events", type=int, default=20000)
+    memory.add_argument("--channels", type=int, default=500)
+    memory.add_argument("--mapped", type=int, default=10)
+    memory.add_argument("--max-messages", type=int, default=0)
+    memory.set_defaults(func=bench_memory)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
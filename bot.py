@@ -1,85 +1,904 @@
 import selfcord
 import discord
 import asyncio
+import bisect
 import json
+import copy
 import re
 import io
 import aiohttp
+from aiohttp import web
 from typing import Dict, List
 import logging
+import logging.handlers
+import queue
+import threading
+import atexit
 import discord.ext.commands
 import os
+import sys
+import signal
+import time
+import sqlite3
+import hashlib
+import tempfile
+import contextlib
+from collections import OrderedDict
 from datetime import datetime
 
 # 日志配置
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+class SizeAndTimeRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """按时间轮转，单个文件超过 max_bytes 时也提前轮转；同一周期内多次轮转的文件追加时间与序号，不互相覆盖。
+    清理旧文件按修改时间而不是文件名排序，因此总是保留最新的 backup_count 个"""
+
+    def __init__(self, filename, max_bytes=50 * 1024 * 1024, when="midnight", backup_count=7, encoding="utf-8"):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding=encoding)
+        self.max_bytes = max_bytes
+        self.namer = self._unique_name
+
+    @staticmethod
+    def _unique_name(name):
+        if not os.path.exists(name):
+            return name
+        stamp = time.strftime("%H%M%S")
+        index = 1
+        while os.path.exists(f"{name}.{stamp}.{index:03d}"):
+            index += 1
+        return f"{name}.{stamp}.{index:03d}"
+
+    def getFilesToDelete(self):
+        directory, base = os.path.split(self.baseFilename)
+        backups = []
+        for name in os.listdir(directory or "."):
+            if name.startswith(base + ".") and self.extMatch.match(name[len(base) + 1:].split(".")[0]):
+                path = os.path.join(directory, name)
+                with contextlib.suppress(OSError):
+                    backups.append((os.stat(path).st_mtime_ns, name, path))
+        if len(backups) <= self.backupCount:
+            return []
+        backups.sort()
+        return [path for _, _, path in backups[:len(backups) - self.backupCount]]
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+class RepeatFilter(logging.Filter):
+    """同一条日志（相同位置、级别与内容）每个窗口内最多输出 burst 次，其余只计数；
+    窗口结束时为每条被省略的日志单独输出一条汇总，窗口内没有新日志时由定时器触发"""
+
+    def __init__(self, burst=5, window=60.0, emit=None):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.emit = emit  # 输出汇总记录（队列处理器的 emit，不再经过本过滤器）
+        self._counts = {}  # key -> [次数, 首条记录]
+        self._window_start = time.monotonic()
+        self._timer = None
+        self._lock = threading.Lock()  # 各线程都可能写日志
+
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+        with self._lock:
+            if time.monotonic() - self._window_start >= self.window:
+                self._roll()
+            key = (record.pathname, record.lineno, record.levelno, record.msg)
+            entry = self._counts.get(key)
+            if entry is None:
+                self._counts[key] = [1, record]
+                return True
+            entry[0] += 1
+            if entry[0] > self.burst and self._timer is None:
+                remaining = self._window_start + self.window - time.monotonic()
+                self._timer = threading.Timer(max(0.0, remaining), self.flush, args=(self._window_start,))
+                self._timer.daemon = True
+                self._timer.start()
+            return entry[0] <= self.burst
+
+    def flush(self, window_start=None):
+        """结束窗口并输出汇总；定时器传入所属窗口，窗口已被新日志结束时不再重复处理"""
+        with self._lock:
+            if window_start is None or window_start == self._window_start:
+                self._roll()
+
+    def _roll(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for count, record in self._counts.values():
+            if count > self.burst and self.emit is not None:
+                self.emit(logging.LogRecord(
+                    record.name, record.levelno, record.pathname, record.lineno,
+                    f"前 {self.window:g}s 内有 {count - self.burst} 条重复日志已省略: {record.getMessage()}",
+                    None, None, record.funcName,
+                ))
+        self._counts.clear()
+        self._window_start = time.monotonic()
+
+_log_listener = None
+_repeat_filter = None
+
+def setup_logging(config=None):
+    """日志记录经队列交给后台线程写入控制台与轮转文件，事件循环线程只做入队；可重复调用以应用新配置"""
+    global _log_listener, _repeat_filter
+    config = config or {}
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    file_handler = SizeAndTimeRotatingFileHandler(
+        config.get("path", "bot.log"),
+        max_bytes=config.get("max_bytes", 50 * 1024 * 1024),
+        when=config.get("when", "midnight"),
+        backup_count=config.get("backup_count", 7),
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    repeat_filter = RepeatFilter(config.get("repeat_burst", 5), config.get("repeat_window", 60.0), queue_handler.emit)
+    queue_handler.addFilter(repeat_filter)
+    if _repeat_filter is not None:
+        _repeat_filter.flush()
+    _repeat_filter = repeat_filter
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+    _log_listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, stream_handler)
+    _log_listener.start()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, str(config.get("level", "INFO")).upper(), logging.INFO))
+
+def stop_logging():
+    """输出未到期的重复汇总，停止后台写日志线程并写完队列中剩余的记录；可重复调用"""
+    global _log_listener, _repeat_filter
+    if _repeat_filter is not None:
+        _repeat_filter.flush()
+        _repeat_filter = None
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
+setup_logging()
+atexit.register(stop_logging)
 logger = logging.getLogger(__name__)
 
+# HTTP 连接池
+class HttpPool:
+    """进程内共享的 aiohttp 会话：连接复用、按主机限流、DNS 缓存，并统计连接池指标"""
+
+    def __init__(self, limit=100, limit_per_host=10, keepalive_timeout=30, dns_ttl=300):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self._session = None
+        self._connector = None
+        self._lock = asyncio.Lock()
+        self.requests = 0
+        self.handshakes = 0
+        self.reused = 0
+
+    def configure(self, options):
+        """按 config.json 中的 http 段覆盖默认参数（需在首次使用前调用）"""
+        self.limit = options.get("limit", self.limit)
+        self.limit_per_host = options.get("limit_per_host", self.limit_per_host)
+        self.keepalive_timeout = options.get("keepalive_timeout", self.keepalive_timeout)
+        self.dns_ttl = options.get("dns_ttl", self.dns_ttl)
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.handshakes += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.reused += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    async def get_session(self):
+        """获取共享会话，首次调用时在当前事件循环中创建"""
+        if self._session is not None and not self._session.closed:
+            return self._session
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                self._connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    ttl_dns_cache=self.dns_ttl,
+                    use_dns_cache=True,
+                    keepalive_timeout=self.keepalive_timeout,
+                    enable_cleanup_closed=True,
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=self._connector,
+                    trace_configs=[self._trace_config()],
+                )
+                logger.info(f"🌐 HTTP 连接池已创建 (limit={self.limit}, limit_per_host={self.limit_per_host})")
+        return self._session
+
+    def stats(self):
+        """连接池统计：打开连接数、复用率、握手次数"""
+        open_connections = 0
+        if self._connector is not None and not self._connector.closed:
+            idle = sum(len(conns) for conns in self._connector._conns.values())
+            open_connections = idle + len(self._connector._acquired)
+        acquired = self.handshakes + self.reused
+        return {
+            "requests": self.requests,
+            "open_connections": open_connections,
+            "handshakes": self.handshakes,
+            "reused": self.reused,
+            "reuse_ratio": round(self.reused / acquired, 3) if acquired else 0.0,
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            # 给 SSL 连接留出优雅关闭的时间，避免 "Unclosed client session" 警告
+            await asyncio.sleep(0.25)
+            logger.info(f"🌐 HTTP 连接池已关闭: {self.stats()}")
+        self._session = None
+        self._connector = None
+
+HTTP_POOL = HttpPool()
+
+# 运行指标
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_NAMES = {
+    "on_message": "监听入队",
+    "queue_wait": "队列等待",
+    "normalize": "embed 标准化",
+    "fetch_message": "HTTP 获取消息",
+    "translate": "整条翻译",
+    "translate_request": "翻译请求",
+    "download": "附件下载",
+    "rate_limit_wait": "限速等待",
+    "send": "Discord 发送",
+    "forward": "转发（含发送）",
+    "end_to_end": "端到端（收到至送达）",
+}
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_label_value(value)}"' for name, value in zip(names, values)) + "}"
+
+class Metrics:
+    """进程内运行指标：各阶段耗时直方图与按路由的消息/字节计数；队列、限速、缓存等已有统计在抓取时再汇总。
+    记录一次只是一次二分查找加几次字典更新，生产环境可以常开"""
+
+    COUNTERS = {
+        "forwarded_messages": ("按路由统计的消息数", ("source", "target", "result")),
+        "forwarded_bytes": ("按路由统计的发送字节数（文本 + 附件）", ("source", "target")),
+        "received_messages": ("监听到的消息数", ("source",)),
+    }
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.enabled = True
+        self.started = time.time()
+        self._histograms = {}  # 阶段 -> [各桶计数（最后一个为 +Inf）, 耗时总和]
+        self._counters = {}  # (指标名, 标签值元组) -> 计数
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        hist = self._histograms.get(stage)
+        if hist is None:
+            hist = self._histograms[stage] = [[0] * (len(self.buckets) + 1), 0.0]
+        hist[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        hist[1] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, labels=(), value=1):
+        if not self.enabled:
+            return
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _quantile(self, counts, q):
+        """按桶线性插值估算分位数（与 Prometheus histogram_quantile 相同的做法）"""
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.buckets[-1]
+
+    def gauges(self):
+        """抓取时从各组件的现有统计汇总：[(指标名, 类型, 说明, [(标签名, 标签值, 值)])]"""
+        queue = FORWARD_QUEUE.stats()
+        limiter = ROUTE_LIMITER.stats()
+        cache = TRANSLATION_CACHE.stats()
+        gateway = TRANSLATE_GATEWAY.stats()
+        outbox = OUTBOX.stats()
+        pool = HTTP_POOL.stats()
+        return [
+            ("queue_depth", "gauge", "各目标转发队列中等待的消息数",
+             [(("target",), (key,), depth) for key, depth in FORWARD_QUEUE.depth().items()]),
+            ("queue_enqueued_total", "counter", "进入转发队列的消息数", [((), (), queue["enqueued"])]),
+            ("queue_dropped_total", "counter", "队列满时丢弃的消息数", [((), (), queue["dropped"])]),
+            ("queue_failed_total", "counter", "转发任务异常数", [((), (), queue["failed"])]),
+            ("rate_limit_waits_total", "counter", "发送前等待限速的次数", [((), (), limiter["waits"])]),
+            ("rate_limit_wait_seconds_total", "counter", "等待限速的总时长", [((), (), limiter["wait_seconds"])]),
+            ("translate_cache_hits_total", "counter", "翻译缓存命中数", [((), (), cache["hits"])]),
+            ("translate_cache_misses_total", "counter", "翻译缓存未命中数", [((), (), cache["misses"])]),
+            ("translate_cache_hit_ratio", "gauge", "翻译缓存命中率", [((), (), cache["hit_ratio"])]),
+            ("translate_calls_avoided_total", "counter", "本地检测省下的翻译请求数", [((), (), LANGUAGE_DETECTOR.calls_avoided)]),
+            ("translate_fallbacks_total", "counter", "翻译不可用时转发原文的次数", [((), (), gateway["fallbacks"])]),
+            ("translate_breaker_open", "gauge", "翻译断路器是否断开", [((), (), int(gateway["state"] != "closed"))]),
+            ("outbox_depth", "gauge", "发件箱中未完成的投递数", [((), (), outbox["depth"])]),
+            ("outbox_retries_total", "counter", "发件箱重试次数", [((), (), outbox["retries"])]),
+            ("http_open_connections", "gauge", "HTTP 连接池打开的连接数", [((), (), pool["open_connections"])]),
+            ("uptime_seconds", "gauge", "进程运行时长", [((), (), round(time.time() - self.started, 1))]),
+        ]
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = [
+            "# HELP forwarder_stage_seconds 各处理阶段耗时",
+            "# TYPE forwarder_stage_seconds histogram",
+        ]
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for stage, (counts, total) in sorted(self._histograms.items()):
+            cumulative = 0
+            for le, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(f"forwarder_stage_seconds_bucket{_labels(('stage', 'le'), (stage, le))} {cumulative}")
+            lines.append(f"forwarder_stage_seconds_sum{_labels(('stage',), (stage,))} {total:.6f}")
+            lines.append(f"forwarder_stage_seconds_count{_labels(('stage',), (stage,))} {cumulative}")
+        for name, (help_text, label_names) in self.COUNTERS.items():
+            lines.append(f"# HELP forwarder_{name}_total {help_text}")
+            lines.append(f"# TYPE forwarder_{name}_total counter")
+            for (counter, values), value in sorted(self._counters.items()):
+                if counter == name:
+                    lines.append(f"forwarder_{name}_total{_labels(label_names, values)} {value}")
+        for name, kind, help_text, samples in self.gauges():
+            lines.append(f"# HELP forwarder_{name} {help_text}")
+            lines.append(f"# TYPE forwarder_{name} {kind}")
+            for label_names, values, value in samples:
+                lines.append(f"forwarder_{name}{_labels(label_names, values)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """供 web 管理页展示的 JSON：各阶段次数/平均/分位数、按路由计数与汇总统计"""
+        stages = []
+        for stage, (counts, total) in self._histograms.items():
+            count = sum(counts)
+            stages.append({
+                "stage": stage,
+                "name": STAGE_NAMES.get(stage, stage),
+                "count": count,
+                "avg_ms": round(total / count * 1e3, 1) if count else 0.0,
+                "p50_ms": round(self._quantile(counts, 0.5) * 1e3, 1),
+                "p95_ms": round(self._quantile(counts, 0.95) * 1e3, 1),
+                "p99_ms": round(self._quantile(counts, 0.99) * 1e3, 1),
+            })
+        stages.sort(key=lambda s: list(STAGE_NAMES).index(s["stage"]) if s["stage"] in STAGE_NAMES else len(STAGE_NAMES))
+        routes = {}
+        for (name, values), value in self._counters.items():
+            if name == "forwarded_messages":
+                routes.setdefault(values[:2], {})[values[2]] = value
+            elif name == "forwarded_bytes":
+                routes.setdefault(values, {})["bytes"] = value
+        return {
+            "uptime": round(time.time() - self.started, 1),
+            "stages": stages,
+            "routes": [{"source": source, "target": target, **counts} for (source, target), counts in sorted(routes.items())],
+            "received": {values[0]: value for (name, values), value in self._counters.items() if name == "received_messages"},
+            "queue_depth": FORWARD_QUEUE.depth(),
+            "queue": FORWARD_QUEUE.stats(),
+            "rate_limit": ROUTE_LIMITER.stats(),
+            "translate_cache": TRANSLATION_CACHE.stats(),
+            "translate_gateway": TRANSLATE_GATEWAY.stats(),
+            "language_detector": LANGUAGE_DETECTOR.stats(),
+            "outbox": OUTBOX.stats(),
+            "http": HTTP_POOL.stats(),
+        }
+
+METRICS = Metrics()
+
+async def start_metrics_server(host="127.0.0.1", port=9108):
+    """在 bot 进程内提供 /metrics（Prometheus 文本格式）与 /metrics.json（web 管理页使用），返回 AppRunner"""
+    async def metrics(request):
+        return web.Response(text=METRICS.render(), content_type="text/plain", charset="utf-8")
+
+    async def metrics_json(request):
+        return web.json_response(METRICS.snapshot())
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/metrics.json", metrics_json)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 指标接口已启动: http://{host}:{port}/metrics")
+    return runner
+
+async def report_stats(interval=300):
+    """定期输出连接池与缓存统计"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"🌐 HTTP 连接池统计: {HTTP_POOL.stats()}")
+        logger.info(f"🗂️ 翻译缓存统计: {TRANSLATION_CACHE.stats()} | 网关: {TRANSLATE_GATEWAY.stats()} | 本地检测: {LANGUAGE_DETECTOR.stats()}")
+        logger.info(f"📬 转发队列统计: {FORWARD_QUEUE.stats()} | 限速: {ROUTE_LIMITER.stats()}")
+        logger.info(f"📮 发件箱统计: {OUTBOX.stats()}")
+        logger.info(f"🎧 监听账号统计: {LISTENERS.stats()}")
+        logger.info(f"🧠 内存统计: {memory_report(LISTENERS.listeners)}")
+
+# 翻译缓存
+class TranslationCache:
+    """翻译结果缓存：内存 LRU + SQLite 磁盘层，按 (文本, 目标语言, 模型) 索引，支持 TTL 过期"""
+
+    def __init__(self, path="translate_cache.db", max_entries=5000, ttl=7 * 86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        if self._db is None and self.path:
+            try:
+                self._db = sqlite3.connect(self.path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS translations ("
+                    "key TEXT PRIMARY KEY, translated TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._db.execute("DELETE FROM translations WHERE created_at < ?", (time.time() - self.ttl,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"❌ 翻译缓存数据库不可用，仅使用内存缓存: {e}")
+                self.path = None
+                self._db = None
+        return self._db
+
+    @staticmethod
+    def _key(text, target_language, model):
+        raw = f"{target_language.lower()}\0{model}\0{text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, translated, created_at):
+        self._memory[key] = (translated, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, text, target_language, model):
+        """命中返回译文，未命中或已过期返回 None"""
+        key = self._key(text, target_language, model)
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._memory[key]
+        db = self._connect()
+        if db is not None:
+            try:
+                row = db.execute(
+                    "SELECT translated, created_at FROM translations WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"翻译缓存读取失败: {e}")
+                row = None
+            if row is not None and now - row[1] < self.ttl:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    def put(self, text, target_language, model, translated):
+        key = self._key(text, target_language, model)
+        now = time.time()
+        self._remember(key, translated, now)
+        db = self._connect()
+        if db is not None:
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO translations (key, translated, created_at) VALUES (?, ?, ?)",
+                    (key, translated, now),
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"翻译缓存写入失败: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+TRANSLATION_CACHE = TranslationCache()
+
 # 翻译功能
-async def translate_text(text, target_language, api_key, model="gpt-4o-mini"):
-    """调用AI接口翻译文本"""
-    if not text.strip():
-        return text
-    
-    url = "https://geekai.co/api/v1/chat/completions"
+GEEKAI_CHAT_URL = "https://geekai.co/api/v1/chat/completions"
+
+LANGUAGE_NAMES = {
+    "chinese": "中文",
+    "english": "English",
+}
+
+def build_translate_prompt(text, target_language):
+    """根据目标语言生成单段翻译提示词，不支持的语言返回 None"""
+    if target_language.lower() == "chinese":
+        keep = "，⟦0⟧ 这样的占位符原样保留" if "⟦" in text else ""
+        return f"请将以下文本翻译成中文，保持原有的格式和语气{keep}：\n\n{text}"
+    elif target_language.lower() == "english":
+        keep = ", keeping placeholders like ⟦0⟧ unchanged" if "⟦" in text else ""
+        return f"Please translate the following text to English, maintaining the original format and tone{keep}:\n\n{text}"
+    return None
+
+async def post_chat_completion(api_key, model, messages, **extra):
+    """调用 chat-completions 接口，成功返回回复文本，失败返回 None"""
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
+    data = {"model": model, "messages": messages, **extra}
+
+    async def send():
+        session = await HTTP_POOL.get_session()
+        with METRICS.timer("translate_request"):
+            async with session.post(GEEKAI_CHAT_URL, headers=headers, json=data) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return result.get('choices', [{}])[0].get('message', {}).get('content', '')
+                logger.error(f"翻译失败: {response.status} - {await response.text()}")
+                return None
+
+    # 超时、并发、预算与断路器都由翻译网关控制，不可用时抛出 TranslationUnavailable
+    return await TRANSLATE_GATEWAY.request(model, send)
+
+async def translate_text(text, target_language, api_key, model="gpt-4o-mini"):
+    """调用AI接口翻译文本"""
+    if not text.strip():
+        return text
     
     # 根据目标语言设置提示词
-    if target_language.lower() == "chinese":
-        prompt = f"请将以下文本翻译成中文，保持原有的格式和语气：\n\n{text}"
-    elif target_language.lower() == "english":
-        prompt = f"Please translate the following text to English, maintaining the original format and tone:\n\n{text}"
-    else:
+    prompt = build_translate_prompt(text, target_language)
+    if prompt is None:
         return text  # 不支持的语言直接返回原文
     
-    data = {
-        "model": model,
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ]
-    }
-    
+    cached = TRANSLATION_CACHE.get(text, target_language, model)
+    if cached is not None:
+        return cached
+    return await _translate_uncached(text, prompt, target_language, api_key, model)
+
+async def _translate_uncached(text, prompt, target_language, api_key, model):
+    """已确认缓存未命中时直接请求接口（批量路径已查过缓存，不再重复计入命中率）"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    translated_text = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                    logger.info(f"翻译成功: {text[:50]}... -> {translated_text[:50]}...")
-                    return translated_text
-                else:
-                    logger.error(f"翻译失败: {response.status} - {await response.text()}")
-                    return text
+        translated_text = await post_chat_completion(api_key, model, [{"role": "user", "content": prompt}])
+        if translated_text is None:
+            return text
+        logger.info(f"翻译成功: {text[:50]}... -> {translated_text[:50]}...")
+        if translated_text:
+            TRANSLATION_CACHE.put(text, target_language, model, translated_text)
+        return translated_text
+    except TranslationUnavailable:
+        raise
     except Exception as e:
         logger.error(f"翻译异常: {e}")
         return text
 
-def should_translate_message(channel_id):
-    """检查是否需要翻译消息"""
-    if channel_id in CONFIG["channel_mapping"]:
-        channel_config = CONFIG["channel_mapping"][channel_id]
-        return channel_config.get("translate", {}).get("enabled", False)
-    return False
+def parse_batch_translation(reply, expected):
+    """解析批量翻译回复，要求为 {"translations": [...]} 且条数一致，否则返回 None"""
+    if not reply:
+        return None
+    reply = reply.strip()
+    # 兼容模型用 ```json 代码块包裹的回复
+    if reply.startswith("```"):
+        reply = reply.strip("`")
+        if reply.startswith("json"):
+            reply = reply[4:]
+    try:
+        parsed = json.loads(reply)
+    except (ValueError, TypeError):
+        return None
+    if isinstance(parsed, dict):
+        parsed = parsed.get("translations")
+    if not isinstance(parsed, list) or len(parsed) != expected:
+        return None
+    if not all(isinstance(item, str) for item in parsed):
+        return None
+    return parsed
+
+async def translate_batch(texts, target_language, api_key, model="gpt-4o-mini"):
+    """一次请求翻译多段文本，回复无法解析时回退为并发逐段翻译；返回与 texts 等长的列表"""
+    if not texts:
+        return []
+    language = LANGUAGE_NAMES.get(target_language.lower())
+    if language is None:
+        return list(texts)
+
+    # 先查缓存，只把未命中的段落发给接口
+    results = [TRANSLATION_CACHE.get(t, target_language, model) for t in texts]
+    pending = [i for i, r in enumerate(results) if r is None]
+    if not pending:
+        return results
+    translations = await _translate_uncached_batch([texts[i] for i in pending], language, target_language, api_key, model)
+    for i, translated in zip(pending, translations):
+        results[i] = translated
+    return results
+
+async def _translate_uncached_single(text, target_language, api_key, model):
+    if not text.strip():
+        return text
+    return await _translate_uncached(text, build_translate_prompt(text, target_language), target_language, api_key, model)
+
+async def _translate_uncached_batch(texts, language, target_language, api_key, model):
+    if len(texts) == 1:
+        return [await _translate_uncached_single(texts[0], target_language, api_key, model)]
+
+    messages = [
+        {
+            "role": "system",
+            "content": (
+                f"You are a translator. Translate every string in the `segments` array of the user's JSON into {language}, "
+                "keeping the original formatting, markdown, line breaks and tone, and leaving placeholders like ⟦0⟧ unchanged. "
+                "Reply with a JSON object {\"translations\": [...]} containing exactly one translated string per segment, in the same order."
+            )
+        },
+        {
+            "role": "user",
+            "content": json.dumps({"segments": texts}, ensure_ascii=False)
+        }
+    ]
+    try:
+        reply = await post_chat_completion(api_key, model, messages, response_format={"type": "json_object"})
+        translations = parse_batch_translation(reply, len(texts))
+        if translations is not None:
+            logger.info(f"批量翻译成功: {len(texts)} 段 (模型: {model})")
+            for text, translated in zip(texts, translations):
+                if translated:
+                    TRANSLATION_CACHE.put(text, target_language, model, translated)
+            return translations
+        logger.warning(f"批量翻译回复无法解析，回退为逐段翻译 ({len(texts)} 段)")
+    except TranslationUnavailable:
+        # 网关不可用时逐段翻译只会更慢，直接交给上层回退为原文
+        raise
+    except Exception as e:
+        logger.error(f"批量翻译异常，回退为逐段翻译: {e}")
+    return list(await asyncio.gather(*(_translate_uncached_single(t, target_language, api_key, model) for t in texts)))
+
+# 本地语言检测
+# 需要原样保留的片段：代码块、行内代码、链接、提及、频道、身份组、自定义表情、时间戳
+PROTECTED_SPAN = re.compile(
+    r"```.*?```|`[^`\n]+`|<?https?://[^\s>]+>?|<(?:@[!&]?|#)\d+>|<a?:\w+:\d+>|<t:-?\d+(?::[tTdDfFR])?>",
+    re.DOTALL,
+)
+# 不需要翻译的内容：行情代码、数字（含小数、百分比、货币符号）
+UNTRANSLATABLE = re.compile(r"\$[A-Za-z]{1,10}\b|[+\-]?[$¥€£]?\d[\d,.]*%?[KkMmBb]?")
+CJK_CHAR = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+KANA_HANGUL = re.compile(r"[\u3040-\u30ff\uac00-\ud7af]")
+LATIN_WORD = re.compile(r"[A-Za-z\u00c0-\u024f]+(?:'[A-Za-z]+)?")
+OTHER_LETTER = re.compile(r"[^\W\d_A-Za-z\u00c0-\u024f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+ENGLISH_STOPWORDS = frozenset(
+    "a an the and or but if of to in on at by for with from as is are was were be been has have had "
+    "do does did not no this that these those it its we you he she they i my our your their will would "
+    "can could should may might must just new now up down out over than then there here what when which who".split()
+)
+PLACEHOLDER = "⟦{}⟧"
+
+class PreparedSegment:
+    """遮蔽了受保护片段的待翻译文本；restore 把译文中的占位符换回原文，占位符丢失时退回原文"""
+
+    __slots__ = ("original", "masked", "spans")
+
+    def __init__(self, original, masked, spans):
+        self.original = original
+        self.masked = masked
+        self.spans = spans
+
+    def restore(self, translated):
+        if not translated:
+            return self.original
+        for i, span in enumerate(self.spans):
+            placeholder = PLACEHOLDER.format(i)
+            if placeholder not in translated:
+                LANGUAGE_DETECTOR.restore_failures += 1
+                return self.original
+            translated = translated.replace(placeholder, span)
+        return translated
+
+class LanguageDetector:
+    """翻译前的本地预处理：按文字类别占比判断文本是否已是目标语言、是否根本没有可翻译的内容，
+    需要翻译的文本先遮蔽链接、提及等片段，避免模型改写"""
+
+    def __init__(self):
+        self.enabled = True
+        self.chinese_ratio = 0.7
+        self.english_stopword_ratio = 0.15
+        self.segments = 0
+        self.skipped_empty = 0
+        self.skipped_target = 0
+        self.calls_avoided = 0
+        self.restore_failures = 0
+
+    def detect(self, text):
+        """返回 empty（没有可翻译的文字）、chinese、english 或 other"""
+        stripped = UNTRANSLATABLE.sub(" ", PROTECTED_SPAN.sub(" ", text))
+        cjk = len(CJK_CHAR.findall(stripped))
+        kana = len(KANA_HANGUL.findall(stripped))
+        words = LATIN_WORD.findall(stripped)
+        other = len(OTHER_LETTER.findall(stripped))
+        # 一个汉字与一个拉丁单词大致承载相同的信息量
+        units = cjk + kana + len(words) + other
+        if units == 0:
+            return "empty"
+        if not kana and cjk / units >= self.chinese_ratio:
+            return "chinese"
+        if words and len(words) == units and all(w.isascii() for w in words):
+            stopwords = sum(1 for w in words if w.lower() in ENGLISH_STOPWORDS)
+            # 短文本（如 embed 字段名）没有足够的虚词可供判断，纯 ASCII 即视为英文
+            if len(words) <= 3 or stopwords / len(words) >= self.english_stopword_ratio:
+                return "english"
+        return "other"
+
+    def prepare(self, text, target_language):
+        """不需要翻译时返回 None，否则返回 PreparedSegment"""
+        self.segments += 1
+        if not self.enabled:
+            return PreparedSegment(text, text, [])
+        language = self.detect(text)
+        if language == "empty":
+            self.skipped_empty += 1
+            return None
+        if language == target_language.lower():
+            self.skipped_target += 1
+            return None
+        spans = []
+
+        def mask(match):
+            spans.append(match.group())
+            return PLACEHOLDER.format(len(spans) - 1)
+
+        return PreparedSegment(text, PROTECTED_SPAN.sub(mask, text), spans)
 
-def get_translate_config(channel_id):
-    """获取翻译配置"""
-    if channel_id in CONFIG["channel_mapping"]:
-        channel_config = CONFIG["channel_mapping"][channel_id]
-        return channel_config.get("translate", {})
-    return {}
+    def stats(self):
+        return {
+            "segments": self.segments,
+            "skipped_empty": self.skipped_empty,
+            "skipped_target": self.skipped_target,
+            "calls_avoided": self.calls_avoided,
+            "restore_failures": self.restore_failures,
+        }
+
+LANGUAGE_DETECTOR = LanguageDetector()
+
+def collect_translatable_segments(content, embeds):
+    """收集消息中所有需要翻译的文本段，返回 [(位置, 文本)]；位置用于回填"""
+    segments = []
+    if content and content.strip():
+        segments.append((("content",), content))
+    for i, embed in enumerate(embeds or []):
+        if embed.title:
+            segments.append((("title", i), embed.title))
+        if embed.description:
+            segments.append((("description", i), embed.description))
+        for j, field in enumerate(embed.fields):
+            if field.name and field.name.strip():
+                segments.append((("field_name", i, j), field.name))
+            if field.value and field.value.strip():
+                segments.append((("field_value", i, j), field.value))
+    return segments
+
+def apply_translated_segments(content, embeds, segments, translations):
+    """把翻译结果写回 content 与 embeds 列表，返回新的 content"""
+    field_updates = {}
+    copied = set()
+    for (position, original), translated in zip(segments, translations):
+        if not translated or translated == original:
+            continue
+        kind = position[0]
+        if kind == "content":
+            content = translated
+            continue
+        # embeds 可能被多个目标共享，且 Embed.copy 与原对象共用 fields 字典，首次修改前先深拷贝
+        i = position[1]
+        if i not in copied:
+            embeds[i] = discord.Embed.from_dict(copy.deepcopy(embeds[i].to_dict()))
+            copied.add(i)
+        if kind == "title":
+            embeds[i].title = translated
+        elif kind == "description":
+            embeds[i].description = translated
+        else:
+            # embed.fields 返回的是副本，需要通过 set_field_at 回写
+            key = position[1:]
+            field_updates.setdefault(key, {})[kind] = translated
+    for (i, j), update in field_updates.items():
+        field = embeds[i].fields[j]
+        embeds[i].set_field_at(
+            j,
+            name=update.get("field_name", field.name),
+            value=update.get("field_value", field.value),
+            inline=field.inline,
+        )
+    return content
+
+async def translate_message(content, embeds, translate_config, api_key):
+    """翻译整条消息（content 与所有 embed 文本），批量模式下只发起一次请求"""
+    target_language = translate_config.get("target_language", "chinese")
+    model = translate_config.get("model", "gpt-4o-mini")
+    segments = collect_translatable_segments(content, embeds)
+    if not segments:
+        return content
+    # 已是目标语言或没有可翻译文字的段落不发给模型
+    prepared = [LANGUAGE_DETECTOR.prepare(text, target_language) for _, text in segments]
+    todo = [p for p in prepared if p is not None]
+    batch = translate_config.get("batch", True)
+    LANGUAGE_DETECTOR.calls_avoided += (0 if todo else 1) if batch else len(prepared) - len(todo)
+    if not todo:
+        return content
+    texts = [p.masked for p in todo]
+    logger.info(f"开始翻译 {len(texts)} 段文本 (模型: {model}, 跳过 {len(prepared) - len(todo)} 段)")
+    if batch:
+        pending = translate_batch(texts, target_language, api_key, model)
+    else:
+        pending = asyncio.gather(*(translate_text(t, target_language, api_key, model) for t in texts))
+    # 整条消息的翻译有总时限，超时或网关不可用时原样（可加标记）转发，embeds 未被修改
+    try:
+        translations = await asyncio.wait_for(pending, TRANSLATE_GATEWAY.message_deadline)
+    except (asyncio.TimeoutError, TranslationUnavailable) as e:
+        TRANSLATE_GATEWAY.fallbacks += 1
+        logger.warning(f"⚠️ 翻译不可用，转发原文: {str(e) or '整条消息翻译超时'}")
+        return TRANSLATE_GATEWAY.mark(content)
+    translated = iter(translations)
+    results = [text if p is None else p.restore(next(translated)) for (_, text), p in zip(segments, prepared)]
+    content = apply_translated_segments(content, embeds, segments, results)
+    logger.info(f"消息已翻译为{target_language}")
+    return content
 
 # 加载配置文件
 def load_config():
@@ -100,367 +919,1938 @@ if CONFIG is None:
     logger.error("💡 请检查 config.json 文件是否存在且格式正确")
     exit(1)
 
-# 新增：读取关键字过滤、替换、用户过滤配置
-KEYWORD_FILTER = CONFIG.get("keyword_filter", {})
-KEYWORD_REPLACE = CONFIG.get("keyword_replace", [])
-USER_FILTER = CONFIG.get("user_filter", {})
-
-# 新增：过滤和替换函数
-def should_forward_message(content, author_id):
-    # 用户过滤
-    include_users = set(str(uid) for uid in USER_FILTER.get("include", []))
-    exclude_users = set(str(uid) for uid in USER_FILTER.get("exclude", []))
-    if include_users and str(author_id) not in include_users:
-        return False
-    if str(author_id) in exclude_users:
-        return False
-    # 关键字过滤
-    include_keywords = KEYWORD_FILTER.get("include", [])
-    exclude_keywords = KEYWORD_FILTER.get("exclude", [])
-    if include_keywords and not any(k in content for k in include_keywords):
-        return False
-    if any(k in content for k in exclude_keywords):
-        return False
-    return True
+setup_logging(CONFIG.get("logging", {}))
+HTTP_POOL.configure(CONFIG.get("http", {}))
 
-def replace_keywords(content):
-    for rule in KEYWORD_REPLACE:
-        content = content.replace(rule.get("from", ""), rule.get("to", ""))
-    return content
+_metrics_config = CONFIG.get("metrics", {})
+METRICS.enabled = _metrics_config.get("enabled", True)
+
+_cache_config = CONFIG.get("translate_cache", {})
+if _cache_config.get("enabled", True):
+    TRANSLATION_CACHE.path = _cache_config.get("path", TRANSLATION_CACHE.path)
+    TRANSLATION_CACHE.max_entries = _cache_config.get("max_entries", TRANSLATION_CACHE.max_entries)
+    TRANSLATION_CACHE.ttl = _cache_config.get("ttl", TRANSLATION_CACHE.ttl)
+else:
+    TRANSLATION_CACHE.max_entries = 0
+    TRANSLATION_CACHE.path = None
+
+_detect_config = CONFIG.get("translate_detect", {})
+LANGUAGE_DETECTOR.enabled = _detect_config.get("enabled", True)
+LANGUAGE_DETECTOR.chinese_ratio = _detect_config.get("chinese_ratio", LANGUAGE_DETECTOR.chinese_ratio)
+LANGUAGE_DETECTOR.english_stopword_ratio = _detect_config.get("english_stopword_ratio", LANGUAGE_DETECTOR.english_stopword_ratio)
+
+# 关键字引擎
+class KeywordRule:
+    """单条替换规则"""
+
+    __slots__ = ("replacement", "compiled")
+
+    def __init__(self):
+        self.replacement = None
+        self.compiled = None  # 仅正则规则：单独编译的模式（含整词选项），替换时按原规则展开
+
+# 正则开头的全局选项，如 (?i)；整词匹配需要把它们移到编译选项里，否则包进分组后无法编译
+_GLOBAL_FLAGS = re.compile(r"^(?:\(\?[aiLmsux]+\))+")
+
+def _trie_pattern(words):
+    """把一组字面量编译为前缀树形式的正则，匹配代价取决于关键字长度而不是数量"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return f"(?:{body})?"
+        return body
+
+    return build(trie)
+
+class KeywordSet:
+    """同一类规则（包含、排除或替换）：字面量合并成一个前缀树正则，正则规则各自单独编译；
+    各类分开匹配，互相重叠的关键字不会遮住对方"""
+
+    def __init__(self, key):
+        self.key = key
+        self._literals = {}  # (ignore_case, whole_word) -> {关键字: KeywordRule}
+        self._regex_rules = []  # [(模式, 选项, KeywordRule)]，按配置顺序
+        self.plain = []  # 不带选项的字面量，按配置顺序
+        self.pattern = None  # 全部字面量合并后的正则
+        self._groups = {}
+
+    def __bool__(self):
+        return bool(self._literals or self._regex_rules)
+
+    @staticmethod
+    def _compile_regex(text, ignore_case, whole_word):
+        compiled = re.compile(text, re.IGNORECASE if ignore_case else 0)
+        if not whole_word:
+            return compiled
+        body = _GLOBAL_FLAGS.sub("", text, count=1)
+        return re.compile(rf"(?<!\w)(?:{body})(?!\w)", compiled.flags)
+
+    def add(self, entry):
+        if isinstance(entry, str):
+            entry = {self.key: entry}
+        text = entry.get(self.key, "")
+        if not text:
+            return None  # 空关键字会匹配任何消息，直接忽略
+        ignore_case = bool(entry.get("ignore_case", False))
+        whole_word = bool(entry.get("whole_word", False))
+        if entry.get("regex", False):
+            for pattern, options, rule in self._regex_rules:
+                if pattern == text and options == (ignore_case, whole_word):
+                    return rule
+            try:
+                compiled = self._compile_regex(text, ignore_case, whole_word)
+            except re.error as e:
+                logger.error(f"❌ 关键字正则无效，已忽略: {text} ({e})")
+                return None
+            rule = KeywordRule()
+            rule.compiled = compiled
+            self._regex_rules.append((text, (ignore_case, whole_word), rule))
+            return rule
+        literals = self._literals.setdefault((ignore_case, whole_word), {})
+        if ignore_case:
+            text = text.lower()
+        elif not whole_word and text not in literals:
+            self.plain.append(text)
+        return literals.setdefault(text, KeywordRule())
+
+    @property
+    def only_plain(self):
+        return not self._regex_rules and set(self._literals) <= {(False, False)}
+
+    @staticmethod
+    def _wrap(body, ignore_case, whole_word):
+        if whole_word:
+            body = rf"(?<!\w)(?:{body})(?!\w)"
+        if ignore_case:
+            body = f"(?i:{body})"
+        return body
+
+    def compile(self):
+        alternatives = []
+        for (ignore_case, whole_word), literals in self._literals.items():
+            if not literals:
+                continue
+            alternatives.append("(" + self._wrap(_trie_pattern(literals), ignore_case, whole_word) + ")")
+            self._groups[len(alternatives)] = (literals, ignore_case)
+        if alternatives:
+            try:
+                self.pattern = re.compile("|".join(alternatives))
+            except re.error as e:
+                logger.error(f"❌ 关键字规则编译失败，字面量规则已忽略: {e}")
+                self.pattern = None
+        return self
+
+    def search(self, text):
+        if self.pattern is not None and self.pattern.search(text) is not None:
+            return True
+        return any(rule.compiled.search(text) is not None for _, _, rule in self._regex_rules)
+
+    def _replacement(self, source, match):
+        """返回匹配对应的替换文本；source 为 0 表示字面量正则，否则是第 source 条正则规则"""
+        if source:
+            rule = self._regex_rules[source - 1][2]
+            return match.expand(rule.replacement)
+        literals, ignore_case = self._groups[match.lastindex]
+        text = match.group()
+        rule = literals.get(text.lower() if ignore_case else text)
+        return text if rule is None else rule.replacement
+
+    def sub(self, text):
+        """单次扫描完成全部替换：每处取最靠左的匹配（同一位置按字面量、正则配置顺序），替换结果不再参与匹配"""
+        sources = [self.pattern] + [rule.compiled for _, _, rule in self._regex_rules]
+        pending = [p.search(text) if p is not None else None for p in sources]
+        parts = []
+        pos = 0
+        while True:
+            best = None
+            for k, match in enumerate(pending):
+                if match is not None and (best is None or match.start() < pending[best].start()):
+                    best = k
+            if best is None:
+                break
+            match = pending[best]
+            parts.append(text[pos:match.start()])
+            parts.append(self._replacement(best, match))
+            pos = match.end()
+            if match.end() == match.start():
+                # 空匹配：原字符照抄并前进一位，避免原地打转
+                parts.append(text[pos:pos + 1])
+                pos += 1
+            for k, match in enumerate(pending):
+                # 与已替换区间重叠的候选从新位置重新查找，其余候选仍然有效
+                if match is not None and match.start() < pos:
+                    pending[k] = sources[k].search(text, pos) if pos <= len(text) else None
+        if not parts:
+            return text
+        parts.append(text[pos:])
+        return "".join(parts)
+
+class KeywordEngine:
+    """在配置加载时编译全部包含/排除/替换规则。包含与排除各自在原文上匹配，替换只扫描一遍文本，
+    各条替换同时生效（A→B、B→C 时 "A" 得到 "B"）；规则很少且都不带选项时直接用 in / str.replace，比正则更快。
+
+    规则可以是字符串，也可以是带选项的字典：
+    {"keyword": "spam", "ignore_case": true, "whole_word": true, "regex": false}；
+    替换规则使用 "from"/"to" 加相同的选项。
+    """
+
+    PLAIN_LIMIT = 400  # 不带选项的规则总数不超过该值时走 in / str.replace（bench.py keywords 测得的交叉点）
+
+    def __init__(self, include=(), exclude=(), replace=()):
+        self.include = KeywordSet("keyword")
+        self.exclude = KeywordSet("keyword")
+        self.replace = KeywordSet("from")
+        for entry in include:
+            self.include.add(entry)
+        for entry in exclude:
+            self.exclude.add(entry)
+        for entry in replace:
+            rule = self.replace.add(entry)
+            if rule is not None:
+                rule.replacement = entry.get("to", "")
+        self.has_include = bool(self.include)
+        sets = (self.include, self.exclude, self.replace)
+        self._plain = (all(k.only_plain for k in sets)
+                       and sum(len(k.plain) for k in sets) <= self.PLAIN_LIMIT)
+        if self._plain:
+            self._replace_pairs = [(word, self.replace._literals[(False, False)][word].replacement)
+                                   for word in self.replace.plain]
+            # 同一条消息命中多条替换规则时仍走单次扫描，保证替换是同时进行的，与正则路径一致
+            self.replace.compile()
+        else:
+            for keywords in sets:
+                keywords.compile()
+
+    def process(self, text):
+        """过滤并替换：消息应被丢弃时返回 None，否则返回替换后的文本"""
+        if self._plain:
+            if self.has_include and not any(word in text for word in self.include.plain):
+                return None
+            if any(word in text for word in self.exclude.plain):
+                return None
+            hits = [(old, new) for old, new in self._replace_pairs if old in text]
+            if len(hits) == 1:
+                return text.replace(*hits[0])
+            return self.replace.sub(text) if hits else text
+        if self.has_include and not self.include.search(text):
+            return None
+        if self.exclude.search(text):
+            return None
+        return self.replace.sub(text)
+
+# 附件中转
+class AttachmentRelay:
+    """分块下载附件：小文件放内存，超过阈值或超出内存上限时落盘到临时文件"""
+
+    def __init__(self, chunk_size=64 * 1024, spill_threshold=8 * 1024 * 1024, memory_ceiling=32 * 1024 * 1024):
+        self.chunk_size = chunk_size
+        self.spill_threshold = spill_threshold
+        self.memory_ceiling = memory_ceiling
+        self.in_memory = 0
+        self.spilled = 0
+
+    def _reserve(self, size):
+        """为单个附件预留内存额度，返回 0 表示直接落盘"""
+        wanted = size if size else self.spill_threshold
+        if wanted > self.spill_threshold or self.in_memory + wanted > self.memory_ceiling:
+            return 0
+        self.in_memory += wanted
+        return wanted
+
+    @staticmethod
+    def _spill(buffer=None):
+        # 带文件名的临时文件（退出 fetch 时删除）：每个目标上传时各自重新打开，互不影响读指针与关闭
+        fd, path = tempfile.mkstemp(prefix="relay-")
+        os.close(fd)
+        spool = open(path, "w+b")
+        if buffer is not None:
+            spool.write(buffer.getbuffer())
+            buffer.close()
+        return spool
+
+    @contextlib.asynccontextmanager
+    async def fetch(self, url, filename, size=None):
+        """下载附件并产出 discord.File，退出上下文时释放内存额度并删除临时文件"""
+        reserved = self._reserve(size)
+        buffer = io.BytesIO() if reserved else self._spill()
+        if not reserved:
+            self.spilled += 1
+        try:
+            session = await HTTP_POOL.get_session()
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"下载附件失败: HTTP {resp.status}")
+                written = 0
+                async for chunk in resp.content.iter_chunked(self.chunk_size):
+                    written += len(chunk)
+                    if reserved and written > reserved:
+                        # 实际大小超出预留额度，转存到临时文件
+                        buffer = self._spill(buffer)
+                        self.in_memory -= reserved
+                        reserved = 0
+                        self.spilled += 1
+                    buffer.write(chunk)
+            buffer.seek(0)
+            yield discord.File(buffer, filename=filename)
+        finally:
+            buffer.close()
+            self.in_memory -= reserved
+            if not isinstance(buffer, io.BytesIO):
+                with contextlib.suppress(OSError):
+                    os.remove(buffer.name)
+
+_attachment_config = CONFIG.get("attachments", {})
+ATTACHMENT_RELAY = AttachmentRelay(
+    chunk_size=_attachment_config.get("chunk_size", 64 * 1024),
+    spill_threshold=_attachment_config.get("spill_threshold", 8 * 1024 * 1024),
+    memory_ceiling=_attachment_config.get("memory_ceiling", 32 * 1024 * 1024),
+)
+
+MAX_FILES_PER_MESSAGE = 10
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+def file_size(fp):
+    """返回文件对象的总字节数，并把读指针复位到开头"""
+    fp.seek(0, io.SEEK_END)
+    size = fp.tell()
+    fp.seek(0)
+    return size
+
+def pack_attachment_batches(files, max_files, max_bytes):
+    """按每条消息的文件数与总大小上限，把 [(file, size)] 装箱为尽量少的批次；单个超限的文件被丢弃"""
+    batches = []
+    current, current_bytes = [], 0
+    for discord_file, size in files:
+        if size > max_bytes:
+            logger.error(f"❌ 附件 {discord_file.filename} 大小 {size} 超过上传上限 {max_bytes}，已跳过")
+            continue
+        if current and (len(current) >= max_files or current_bytes + size > max_bytes):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(discord_file)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+class SharedAttachments:
+    """一条消息的附件只下载一次，供多个目标复用。
+    每个目标拿到独立的 discord.File：内存中的附件用新的 BytesIO（共享同一份字节，不复制），落盘的附件重新打开临时文件。
+    发送后 aiohttp 会真正关闭文件对象，因此同一个句柄不能在目标之间复用"""
+
+    def __init__(self, files):
+        self.files = files  # [(discord.File, 字节数)]
+
+    def __len__(self):
+        return len(self.files)
+
+    def for_target(self):
+        files = []
+        for f, size in self.files:
+            fp = io.BytesIO(f.fp.getvalue()) if isinstance(f.fp, io.BytesIO) else open(f.fp.name, "rb")
+            files.append((discord.File(fp, filename=f.filename), size))
+        return files
+
+    @staticmethod
+    def close_target(files):
+        """关闭 for_target 打开的句柄（discord.File.close 只恢复 fp.close，不会关闭传入的文件对象）"""
+        for f, _ in files:
+            f.close()
+            f.fp.close()
+
+# 转发队列与限速
+class RouteRateLimiter:
+    """按 Discord 路由桶限速，所有机器人共享；默认每个目标频道 5 条/5 秒，遇到 429 时整个桶暂停"""
+
+    def __init__(self, rate=5, per=5.0):
+        self.rate = rate
+        self.per = per
+        self._buckets = {}  # route -> [剩余令牌, 更新时间, 暂停截止时间]
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _bucket(self, route, now):
+        return self._buckets.setdefault(route, [float(self.rate), now, 0.0])
+
+    async def acquire(self, route):
+        """等待直到该路由桶允许再发送一次"""
+        while True:
+            now = time.monotonic()
+            bucket = self._bucket(route, now)
+            bucket[0] = min(float(self.rate), bucket[0] + (now - bucket[1]) * self.rate / self.per)
+            bucket[1] = now
+            if now < bucket[2]:
+                delay = bucket[2] - now
+            elif bucket[0] >= 1:
+                bucket[0] -= 1
+                return
+            else:
+                delay = (1 - bucket[0]) * self.per / self.rate
+            self.waits += 1
+            self.wait_seconds += delay
+            await asyncio.sleep(delay)
+
+    def block(self, route, retry_after):
+        """收到 429 后暂停整个路由桶"""
+        now = time.monotonic()
+        bucket = self._bucket(route, now)
+        bucket[2] = max(bucket[2], now + retry_after)
+        logger.warning(f"⏳ 路由 {route} 被限速，暂停 {retry_after:.2f}s")
+
+    def stats(self):
+        return {"routes": len(self._buckets), "waits": self.waits, "wait_seconds": round(self.wait_seconds, 3)}
+
+class ForwardQueue:
+    """监听与转发之间的有界队列：每个目标频道一个顺序 worker，保证频道内有序、频道间并行"""
+
+    POLICIES = ("block", "drop_newest", "drop_oldest")
+
+    def __init__(self, max_pending=1000, policy="block"):
+        if policy not in self.POLICIES:
+            logger.error(f"❌ 未知的队列满策略 {policy}，改用 block")
+            policy = "block"
+        self.max_pending = max_pending
+        self.policy = policy
+        self._slots = None
+        self._queues = {}
+        self._workers = {}
+        self.enqueued = 0
+        self.dropped = 0
+        self.failed = 0
+
+    async def put(self, key, job):
+        """把 job（无参协程函数）放入 key 对应的队列；队列满时按策略阻塞或丢弃"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue()
+            self._workers[key] = asyncio.create_task(self._worker(key, queue))
+        if self._slots.locked():
+            if self.policy == "drop_newest" or (self.policy == "drop_oldest" and queue.empty()):
+                self.dropped += 1
+                logger.warning(f"⚠️ 转发队列已满 ({self.max_pending})，丢弃新消息 (目标: {key})")
+                return False
+            if self.policy == "drop_oldest":
+                dropped = queue.get_nowait()
+                queue.task_done()
+                on_drop = getattr(dropped, 'on_drop', None)
+                if on_drop is not None:
+                    on_drop()
+                self._slots.release()
+                self.dropped += 1
+                logger.warning(f"⚠️ 转发队列已满 ({self.max_pending})，丢弃最早的消息 (目标: {key})")
+        await self._slots.acquire()
+        queue.put_nowait(job)
+        self.enqueued += 1
+        return True
+
+    async def _worker(self, key, queue):
+        while True:
+            job = await queue.get()
+            try:
+                await job()
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ 转发任务失败 (目标: {key}): {e}")
+            finally:
+                queue.task_done()
+                self._slots.release()
+
+    def depth(self):
+        return {key: queue.qsize() for key, queue in self._queues.items()}
+
+    def stats(self):
+        return {
+            "pending": sum(self.depth().values()),
+            "workers": len(self._workers),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+    async def close(self):
+        for task in self._workers.values():
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+
+_rate_limit_config = CONFIG.get("rate_limit", {})
+ROUTE_LIMITER = RouteRateLimiter(
+    rate=_rate_limit_config.get("rate", 5),
+    per=_rate_limit_config.get("per", 5.0),
+)
+
+_queue_config = CONFIG.get("forward_queue", {})
+FORWARD_QUEUE = ForwardQueue(
+    max_pending=_queue_config.get("max_pending", 1000),
+    policy=_queue_config.get("policy", "block"),
+)
+
+# 翻译网关
+class TranslationUnavailable(Exception):
+    """断路器打开、排队或请求超时：本次不翻译"""
+
+class TranslationGateway:
+    """翻译接口的统一出口：单次请求时限、全局与按模型的并发上限、令牌桶预算和断路器。
+    连续失败达到阈值后断路器打开，reset_timeout 秒内的请求立即失败；之后放行一个探测请求，成功则恢复"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, timeout=8.0, message_deadline=15.0, concurrency=8, per_model_concurrency=4,
+                 rate=10, per=1.0, failure_threshold=5, reset_timeout=30.0, fallback_marker=""):
+        self.timeout = timeout
+        self.message_deadline = message_deadline
+        self.per_model_concurrency = per_model_concurrency
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fallback_marker = fallback_marker
+        self._global = asyncio.Semaphore(concurrency)
+        self._models = {}
+        self._budget = RouteRateLimiter(rate=rate, per=per)
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.requests = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    def mark(self, content):
+        if self.fallback_marker and content:
+            return f"{self.fallback_marker}{content}"
+        return content
+
+    def _allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+        # 半开状态只放行一个探测请求
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def _record(self, success):
+        self._probing = False
+        if success:
+            if self.state != self.CLOSED:
+                logger.info("✅ 翻译接口已恢复，断路器关闭")
+            self.state = self.CLOSED
+            self._failures = 0
+            return
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"⚠️ 翻译接口连续失败 {self._failures} 次，断路器打开 {self.reset_timeout:g}s")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    async def request(self, model, send):
+        """在时限与各项限制下执行 send()（返回回复文本，失败返回 None）"""
+        if not self._allow():
+            self.rejected += 1
+            raise TranslationUnavailable("断路器打开")
+        self.requests += 1
+        started = []
+
+        async def limited():
+            await self._budget.acquire("translate")
+            model_slot = self._models.setdefault(model, asyncio.Semaphore(self.per_model_concurrency))
+            async with self._global, model_slot:
+                started.append(time.monotonic())
+                return await send()
+
+        try:
+            result = await asyncio.wait_for(limited(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if started:
+                self._record(False)
+            else:
+                # 只是排队超时，不算接口故障
+                self._probing = False
+            raise TranslationUnavailable(f"翻译请求超时 ({self.timeout:g}s)")
+        except asyncio.CancelledError:
+            # 被上层取消（整条消息超时、目标全部放弃）不算结果，但要放出探测名额，否则半开状态会一直拒绝
+            self._probing = False
+            raise
+        except Exception:
+            self._record(False)
+            raise
+        self._record(result is not None)
+        return result
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "fallbacks": self.fallbacks,
+        }
+
+_translate_gateway_config = CONFIG.get("translate_gateway", {})
+TRANSLATE_GATEWAY = TranslationGateway(
+    timeout=_translate_gateway_config.get("timeout", 8.0),
+    message_deadline=_translate_gateway_config.get("message_deadline", 15.0),
+    concurrency=_translate_gateway_config.get("concurrency", 8),
+    per_model_concurrency=_translate_gateway_config.get("per_model_concurrency", 4),
+    rate=_translate_gateway_config.get("rate", 10),
+    per=_translate_gateway_config.get("per", 1.0),
+    failure_threshold=_translate_gateway_config.get("failure_threshold", 5),
+    reset_timeout=_translate_gateway_config.get("reset_timeout", 30.0),
+    fallback_marker=_translate_gateway_config.get("fallback_marker", ""),
+)
+
+# Webhook 投递
+WEBHOOK_NAME_BLOCKLIST = re.compile(r"discord|clyde", re.IGNORECASE)
+
+class WebhookTarget:
+    """通过 webhook 发送的目标频道：走共享 HTTP 连接池，不需要网关会话；接口与频道的 send 保持一致"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        # https://discord.com/api/webhooks/{id}/{token}
+        parts = self.url.split('/')
+        self.id = parts[-2] if len(parts) >= 2 else self.url
+        self.rate_limit_key = f"webhook:{self.id}"
+        self.guild = None
+
+    @staticmethod
+    def _username(name):
+        """webhook 用户名最长 80 个字符，且不能包含 discord/clyde"""
+        name = WEBHOOK_NAME_BLOCKLIST.sub("", name or "").strip()[:80]
+        return name or "未知用户"
+
+    def _request_kwargs(self, payload, files):
+        if not files:
+            return {"json": payload}
+        payload["attachments"] = [{"id": i, "filename": f.filename} for i, f in enumerate(files)]
+        form = aiohttp.FormData()
+        form.add_field("payload_json", json.dumps(payload), content_type="application/json")
+        for i, f in enumerate(files):
+            f.reset()
+            form.add_field(f"files[{i}]", f.fp, filename=f.filename)
+        return {"data": form}
+
+    async def send(self, content=None, embeds=None, files=None, username=None, avatar_url=None):
+        payload = {"allowed_mentions": {"parse": []}}
+        if content:
+            payload["content"] = content
+        if embeds:
+            payload["embeds"] = [e.to_dict() for e in embeds]
+        if username:
+            payload["username"] = self._username(username)
+        if avatar_url:
+            payload["avatar_url"] = avatar_url
+        session = await HTTP_POOL.get_session()
+        for _ in range(2):
+            async with session.post(f"{self.url}?wait=true", **self._request_kwargs(dict(payload), files)) as response:
+                if response.status in (200, 204):
+                    return
+                if response.status == 429:
+                    data = await response.json()
+                    ROUTE_LIMITER.block(self.rate_limit_key, float(data.get("retry_after", ROUTE_LIMITER.per)))
+                    await ROUTE_LIMITER.acquire(self.rate_limit_key)
+                    continue
+                raise RuntimeError(f"webhook 发送失败: {response.status} - {await response.text()}")
+        raise RuntimeError("webhook 发送失败: 持续被限速")
+
+def author_avatar_url(message, raw):
+    """原作者头像地址，用于 webhook 投递"""
+    if message is not None:
+        avatar = getattr(message.author, 'display_avatar', None)
+        return str(avatar.url) if avatar is not None else None
+    author = (raw or {}).get('author') or {}
+    if author.get('id') and author.get('avatar'):
+        return f"https://cdn.discordapp.com/avatars/{author['id']}/{author['avatar']}.png"
+    return None
+
+# 路由表
+class Route:
+    """编译后的单条转发路由：目标频道、发送客户端、过滤集合与翻译设置"""
+
+    __slots__ = (
+        "source_id", "target_id", "remark", "bot_remark", "client", "channel", "webhook",
+        "include_users", "exclude_users", "keywords", "translate", "translate_enabled",
+    )
+
+    def __init__(self, source_id, target_id, remark="", bot_remark="", client=None, webhook=None,
+                 include_users=frozenset(), exclude_users=frozenset(), keywords=None, translate=None):
+        self.source_id = source_id
+        self.target_id = target_id
+        self.remark = remark
+        self.bot_remark = bot_remark
+        self.client = client
+        self.webhook = webhook
+        self.channel = None
+        self.include_users = include_users
+        self.exclude_users = exclude_users
+        self.keywords = keywords or KeywordEngine()
+        self.translate = translate or {}
+        self.translate_enabled = bool(self.translate.get("enabled", False))
+
+    def allows_author(self, author_id):
+        """用户过滤（集合在编译路由表时已预先构建）"""
+        if self.include_users and author_id not in self.include_users:
+            return False
+        return author_id not in self.exclude_users
+
+    def target_channel(self):
+        """返回目标频道对象（webhook 模式下为 WebhookTarget）；机器人就绪前 get_channel 为空，因此首次成功后才缓存"""
+        if self.webhook is not None:
+            return self.webhook
+        if self.channel is None and self.client is not None:
+            self.channel = self.client.get_channel(int(self.target_id))
+        return self.channel
+
+def _clean_entries(entries):
+    """去掉空字符串条目；web 编辑器保存的 [""] 不应被当作规则"""
+    return [e for e in entries or [] if not (isinstance(e, str) and not e.strip())]
+
+def _has_entries(section, keys):
+    return any(_clean_entries(section.get(k)) for k in keys)
+
+def _channel_section(mapping, config, key, keys):
+    """频道自身配置了有效规则时使用频道规则，否则回退到全局规则"""
+    section = mapping.get(key) or {}
+    if _has_entries(section, keys):
+        return section
+    return config.get(key) or {}
+
+def compile_user_filter(user_filter):
+    """把用户过滤配置编译为 (include, exclude) 两个 frozenset"""
+    include_users = frozenset(str(uid).strip() for uid in _clean_entries(user_filter.get("include")))
+    exclude_users = frozenset(str(uid).strip() for uid in _clean_entries(user_filter.get("exclude")))
+    return include_users, exclude_users
+
+def compile_keyword_engine(keyword_filter, keyword_replace):
+    replace = [r for r in keyword_replace or [] if isinstance(r, dict) and r.get("from")]
+    return KeywordEngine(
+        _clean_entries(keyword_filter.get("include")),
+        _clean_entries(keyword_filter.get("exclude")),
+        replace,
+    )
+
+def compile_channel_filters(mapping, config, shared):
+    """编译单个频道的过滤流水线；未配置频道规则的部分复用全局编译结果"""
+    user_filter = _channel_section(mapping, config, "user_filter", ("include", "exclude"))
+    if user_filter is config.get("user_filter"):
+        users = shared["users"]
+    else:
+        users = compile_user_filter(user_filter)
+    keyword_filter = _channel_section(mapping, config, "keyword_filter", ("include", "exclude"))
+    keyword_replace = mapping.get("keyword_replace")
+    if not any(isinstance(r, dict) and r.get("from") for r in keyword_replace or []):
+        keyword_replace = config.get("keyword_replace", [])
+    if keyword_filter is config.get("keyword_filter") and keyword_replace is config.get("keyword_replace"):
+        keywords = shared["keywords"]
+    else:
+        keywords = compile_keyword_engine(keyword_filter, keyword_replace)
+    return users, keywords
+
+# 目标专属的配置项，不从源频道映射继承
+TARGET_ONLY_KEYS = ("target", "targets", "webhook_url")
+
+def mapping_targets(mapping):
+    """展开一个源频道的全部目标：映射自身的 target 加上 targets 列表；列表项未配置的过滤、翻译等设置继承自映射"""
+    base = {k: v for k, v in mapping.items() if k not in TARGET_ONLY_KEYS}
+    entries = [mapping] if mapping.get("target") else []
+    for entry in mapping.get("targets") or []:
+        if isinstance(entry, dict) and entry.get("target"):
+            entries.append({**base, **entry})
+    return entries
+
+def compile_routes(config, token_to_user_id, user_id_to_client):
+    """根据配置一次性解析 源频道 → 目标频道 → 机器人token → user_id → 客户端，返回 {源频道ID: [Route, ...]}"""
+    target_to_bot = {}
+    for bot_config in config["bots"]:
+        for target_channel in bot_config["target_channels"]:
+            target_to_bot[target_channel] = bot_config
+    shared = {
+        "users": compile_user_filter(config.get("user_filter") or {}),
+        "keywords": compile_keyword_engine(config.get("keyword_filter") or {}, config.get("keyword_replace")),
+    }
+    routes = {}
+    webhooks = {}
+    for source_id, source_mapping in config["channel_mapping"].items():
+        targets = [
+            _compile_route(source_id, mapping, config, shared, target_to_bot, webhooks, token_to_user_id, user_id_to_client)
+            for mapping in mapping_targets(source_mapping)
+        ]
+        if targets:
+            routes[source_id] = targets
+    return routes
+
+def _compile_route(source_id, mapping, config, shared, target_to_bot, webhooks, token_to_user_id, user_id_to_client):
+    """编译源频道到单个目标的路由"""
+    target_id = mapping["target"]
+    bot_config = target_to_bot.get(target_id)
+    client = None
+    webhook = None
+    webhook_url = mapping.get("webhook_url")
+    if webhook_url:
+        webhook = webhooks.setdefault(webhook_url, WebhookTarget(webhook_url))
+    elif not bot_config:
+        logger.error(f"❌ 找不到目标频道 {target_id} 对应的机器人")
+    else:
+        user_id = token_to_user_id.get(bot_config["token"])
+        client = user_id_to_client.get(user_id) if user_id else None
+    (include_users, exclude_users), keywords = compile_channel_filters(mapping, config, shared)
+    return Route(
+        source_id,
+        target_id,
+        remark=mapping.get("remark", ""),
+        bot_remark=bot_config.get("remark", "") if bot_config else "",
+        client=client,
+        webhook=webhook,
+        include_users=include_users,
+        exclude_users=exclude_users,
+        keywords=keywords,
+        translate=mapping.get("translate", {}),
+    )
 
 class MessageForwarder:
     def __init__(self, discord_clients, token_to_user_id=None, user_id_to_client=None):
         self.discord_clients = discord_clients
-        self.channel_mapping = CONFIG["channel_mapping"]
-        # 创建目标频道到机器人的映射
-        self.target_to_bot = {}
-        for bot_config in CONFIG["bots"]:
-            for target_channel in bot_config["target_channels"]:
-                self.target_to_bot[target_channel] = bot_config["token"]
         self.token_to_user_id = token_to_user_id or {}
         self.user_id_to_client = user_id_to_client or {}
+        self.routes = {}
+        # 仍在启动中的机器人数量；大于 0 时，没有就绪机器人的路由先等待而不是直接失败
+        self.starting = 0
+        self._routes_changed = asyncio.Event()
+        self.rebuild_routes()
 
-    def set_user_id_to_client(self, mapping):
-        self.user_id_to_client = mapping
-
-    def set_token_to_user_id(self, mapping):
-        self.token_to_user_id = mapping
-
-    async def forward_message(self, source_channel_id: str, message_content: str = "", author_name: str = "未知用户", attachments=None, embeds=None):
-        """转发消息到目标频道，始终优先保留原消息内容，embed只有图片时兜底content为'.'，并打印日志"""
-        logger.info(f"[转发前] content: {repr(message_content)} | embeds: {len(embeds) if embeds else 0} | attachments: {len(attachments) if attachments else 0}")
-        if source_channel_id in self.channel_mapping:
-            target_channel_id = self.channel_mapping[source_channel_id]["target"]
-            # 找到目标频道对应的机器人token
-            target_bot_token = self.target_to_bot.get(target_channel_id)
-            if not target_bot_token:
-                logger.error(f"❌ 找不到目标频道 {target_channel_id} 对应的机器人")
-                return
-            # 通过token找到user_id
-            target_user_id = self.token_to_user_id.get(target_bot_token)
-            if not target_user_id:
-                logger.error(f"❌ 找不到机器人token对应的user_id: {target_bot_token}")
-                return
-            target_client = self.user_id_to_client.get(target_user_id)
-            if not target_client:
-                logger.error(f"❌ 找不到对应的机器人客户端 user_id: {target_user_id}")
-                return
+    def rebuild_routes(self, config=None):
+        """重新编译路由表（启动、机器人登录完成或配置变更时调用）"""
+        self.apply_routes(self.build_routes(config or CONFIG))
+
+    def build_routes(self, config):
+        """按已登录的机器人编译路由表但不生效；配置有误时抛出异常，当前路由不受影响"""
+        return compile_routes(config, self.token_to_user_id, self.user_id_to_client)
+
+    def apply_routes(self, routes):
+        self.routes = routes
+        logger.info(f"🧭 路由表已编译: {len(self.routes)} 个源频道, {sum(len(r) for r in self.routes.values())} 个目标")
+        self.notify_routes()
+
+    def notify_routes(self):
+        """唤醒等待机器人就绪的转发"""
+        self._routes_changed.set()
+        self._routes_changed = asyncio.Event()
+
+    def find_route(self, source_channel_id, target_id):
+        for route in self.routes.get(source_channel_id, ()):
+            if route.target_id == target_id:
+                return route
+        return None
+
+    async def wait_for_route(self, source_channel_id, target_id, timeout):
+        """等待路由的目标机器人就绪，超时或机器人已不在启动中时返回当前路由"""
+        deadline = time.monotonic() + timeout
+        while True:
+            route = self.find_route(source_channel_id, target_id)
+            if route is None or route.webhook is not None:
+                return route
+            if route.client is not None and route.client.is_ready():
+                return route
+            remaining = deadline - time.monotonic()
+            if not self.starting or remaining <= 0:
+                return route
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._routes_changed.wait(), remaining)
+
+    def register_client(self, token, client):
+        """登记已登录的机器人客户端（需再调用 rebuild_routes 生效）"""
+        user_id = client.user.id
+        self.user_id_to_client[user_id] = client
+        self.token_to_user_id[token] = user_id
+        if client not in self.discord_clients:
+            self.discord_clients.append(client)
+
+    def unregister_client(self, token):
+        user_id = self.token_to_user_id.pop(token, None)
+        client = self.user_id_to_client.pop(user_id, None)
+        if client in self.discord_clients:
+            self.discord_clients.remove(client)
+
+    def invalidate_channels(self, client):
+        """机器人重新就绪后清空其路由上缓存的频道对象"""
+        for routes in self.routes.values():
+            for route in routes:
+                if route.client is client:
+                    route.channel = None
+
+    async def forward_message(self, route, message_content: str = "", author_name: str = "未知用户", attachments=None, embeds=None, image_only=None, author_avatar=None):
+        """转发消息到路由的目标频道，始终优先保留原消息内容，embed只有图片时兜底content为'.'，并打印日志；返回是否发送成功。
+        attachments 为已下载的 SharedAttachments"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[转发前] content: {repr(message_content)} | embeds: {len(embeds) if embeds else 0} | attachments: {len(attachments) if attachments else 0}")
+        # 目标机器人还在启动时在这里等待，消息留在该目标的转发队列中
+        route = await self.wait_for_route(route.source_id, route.target_id, BOT_READY_TIMEOUT)
+        if route is None:
+            return False
+        if route.client is None and route.webhook is None:
+            logger.error(f"❌ 目标频道 {route.target_id} 没有可用的机器人客户端")
+            return False
+        target_channel = route.target_channel()
+        if not target_channel:
+            logger.error(f"❌ 找不到目标频道 {route.target_id}")
+            return False
+        try:
+            send_kwargs = {}
+            # 优先保留原消息内容
+            if message_content and message_content.strip():
+                send_kwargs['content'] = message_content
+            elif embeds:
+                if image_only is None:
+                    image_only = all(classify_embed(e) == EMBED_IMAGE_ONLY for e in embeds)
+                if image_only:
+                    send_kwargs['content'] = '.'
+            if embeds:
+                send_kwargs['embeds'] = embeds
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"[转发参数] send_kwargs: {send_kwargs}")
+            files = attachments.for_target() if attachments else []
             try:
-                target_channel = target_client.get_channel(int(target_channel_id))
-                if target_channel:
-                    send_kwargs = {}
-                    # 优先保留原消息内容
-                    if message_content and message_content.strip():
-                        send_kwargs['content'] = message_content
-                    elif embeds:
-                        only_image_embeds = all(
-                            (not e.title and not e.description and not e.fields and e.image and e.image.url)
-                            for e in embeds
-                        )
-                        if only_image_embeds:
-                            send_kwargs['content'] = '.'
-                    if embeds:
-                        send_kwargs['embeds'] = embeds
-                    logger.info(f"[转发参数] send_kwargs: {send_kwargs}")
-                    # 先发文本和embed
-                    if send_kwargs:
-                        await target_channel.send(**send_kwargs)
-                    # 再发附件（如有）
-                    if attachments:
-                        for attachment in attachments:
-                            try:
-                                async with aiohttp.ClientSession() as session:
-                                    async with session.get(attachment.url) as resp:
-                                        if resp.status == 200:
-                                            file_data = await resp.read()
-                                            file_name = attachment.filename
-                                            discord_file = discord.File(io.BytesIO(file_data), filename=file_name)
-                                            await target_channel.send(file=discord_file)
-                                            logger.info(f"✅ 附件已转发: {file_name}")
-                            except Exception as e:
-                                logger.error(f"❌ 附件转发失败: {e}")
-                    logger.info(f"✅ 消息已转发到频道 {target_channel_id}")
-                else:
-                    logger.error(f"❌ 找不到目标频道 {target_channel_id}")
-            except Exception as e:
-                logger.error(f"❌ 转发消息失败: {e}")
+                max_bytes = getattr(getattr(target_channel, 'guild', None), 'filesize_limit', DEFAULT_UPLOAD_LIMIT)
+                batches = pack_attachment_batches(files, MAX_FILES_PER_MESSAGE, max_bytes)
+                # 文本/embed 与第一批附件合并为一条消息，其余附件每批一条
+                if batches:
+                    send_kwargs['files'] = batches[0]
+                # webhook 投递以原作者的名字和头像发送；没有任何可发送的内容时（如仅贴纸、附件全部超限）与机器人一样跳过，
+                # 只带身份信息的请求会被 Discord 拒绝
+                identity = {}
+                if route.webhook is not None and send_kwargs:
+                    identity = {'username': author_name, 'avatar_url': author_avatar}
+                    send_kwargs.update(identity)
+                if send_kwargs:
+                    await self._send(target_channel, **send_kwargs)
+                for batch in batches[1:]:
+                    await self._send(target_channel, files=batch, **identity)
+                if files:
+                    logger.info(f"✅ 附件已转发: {sum(len(b) for b in batches)} 个 ({len(batches)} 批)")
+            finally:
+                SharedAttachments.close_target(files)
+            # 只统计实际发出的附件，超过上传上限被丢弃的不计入
+            packed = {id(f) for batch in batches for f in batch}
+            sent_bytes = len(send_kwargs.get('content', '').encode('utf-8')) + sum(size for f, size in files if id(f) in packed)
+            METRICS.inc("forwarded_bytes", (route.source_id, route.target_id), sent_bytes)
+            logger.info(f"✅ 消息已转发到频道 {route.target_id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ 转发消息失败: {e}")
+            return False
+
+    async def _send(self, target_channel, **kwargs):
+        """按路由桶限速后发送；遇到 429 暂停该路由并重试一次"""
+        route_key = getattr(target_channel, 'rate_limit_key', None) or f"channel:{target_channel.id}"
+        with METRICS.timer("rate_limit_wait"):
+            await ROUTE_LIMITER.acquire(route_key)
+        try:
+            with METRICS.timer("send"):
+                return await target_channel.send(**kwargs)
+        except discord.HTTPException as e:
+            if e.status != 429:
+                raise
+            ROUTE_LIMITER.block(route_key, getattr(e, 'retry_after', None) or ROUTE_LIMITER.per)
+            for f in kwargs.get('files', []):
+                f.reset()
+            with METRICS.timer("rate_limit_wait"):
+                await ROUTE_LIMITER.acquire(route_key)
+            with METRICS.timer("send"):
+                return await target_channel.send(**kwargs)
 
-async def get_latest_message(channel_id, token):
-    """获取频道最新消息"""
-    url = f"https://discord.com/api/v10/channels/{channel_id}/messages?limit=1"
+    async def download_attachments(self, stack, attachments):
+        """并发下载全部附件，返回 [(discord.File, 字节数)]，下载失败的附件记录日志后跳过"""
+        if not attachments:
+            return []
+        with METRICS.timer("download"):
+            results = await asyncio.gather(
+                *(stack.enter_async_context(ATTACHMENT_RELAY.fetch(a.url, a.filename, getattr(a, 'size', None)))
+                  for a in attachments),
+                return_exceptions=True,
+            )
+        files = []
+        for attachment, result in zip(attachments, results):
+            if isinstance(result, BaseException):
+                logger.error(f"❌ 附件转发失败: {attachment.filename} - {result}")
+                continue
+            files.append((result, file_size(result.fp)))
+        return files
+
+async def get_message(channel_id, message_id, token):
+    """按消息ID精确获取消息（用户账号不能调用单条消息接口，因此用 around 查询并校验ID）"""
+    url = f"https://discord.com/api/v10/channels/{channel_id}/messages?around={message_id}&limit=1"
     headers = {"Authorization": token}
     
     try:
-        async with aiohttp.ClientSession() as session:
+        session = await HTTP_POOL.get_session()
+        with METRICS.timer("fetch_message"):
             async with session.get(url, headers=headers) as response:
                 if response.status == 200:
                     messages = await response.json()
-                    if messages:
-                        return messages[0]
-                logger.error(f"获取频道 {channel_id} 最新消息失败: {response.status}")
+                    for message_data in messages:
+                        if str(message_data.get('id')) == str(message_id):
+                            return message_data
+                logger.error(f"获取频道 {channel_id} 消息 {message_id} 失败: {response.status}")
     except Exception as e:
-        logger.error(f"获取频道 {channel_id} 最新消息异常: {e}")
+        logger.error(f"获取频道 {channel_id} 消息 {message_id} 异常: {e}")
     return None
 
-def process_api_message(message_data):
-    """处理 API 返回的消息数据"""
-    content = message_data.get('content', '')
+class RawAttachment:
+    """从原始消息数据构造的附件，字段与 discord.Attachment 转发时用到的部分一致"""
+
+    __slots__ = ("url", "filename", "size")
+
+    def __init__(self, url, filename, size=None):
+        self.url = url
+        self.filename = filename
+        self.size = size
+
+# 断线补发
+class CheckpointStore:
+    """按源频道持久化最后处理的消息ID（SQLite），内存中更新、定期批量落盘。
+
+    与发件箱同一个数据库文件时共用发件箱的连接：发件箱的写事务会保持到下一次批量提交，
+    另开连接写入会在事件循环线程上等到 busy timeout 后失败。
+    """
+
+    def __init__(self, path="forward_state.db"):
+        self.path = path
+        self._db = None
+        self._owns_db = True
+        self._checkpoints = {}
+        self._dirty = set()
+
+    def open(self, connection=None):
+        if connection is not None:
+            self._db = connection
+            self._owns_db = False
+        else:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints (channel_id TEXT PRIMARY KEY, message_id INTEGER NOT NULL)"
+        )
+        self._checkpoints = dict(self._db.execute("SELECT channel_id, message_id FROM checkpoints"))
+        return self
+
+    def get(self, channel_id):
+        return self._checkpoints.get(channel_id)
+
+    def advance(self, channel_id, message_id):
+        message_id = int(message_id)
+        if message_id > self._checkpoints.get(channel_id, 0):
+            self._checkpoints[channel_id] = message_id
+            self._dirty.add(channel_id)
+
+    def flush(self):
+        if self._db is None or not self._dirty:
+            return
+        rows = [(channel_id, self._checkpoints[channel_id]) for channel_id in self._dirty]
+        self._dirty.clear()
+        try:
+            self._db.executemany("INSERT OR REPLACE INTO checkpoints (channel_id, message_id) VALUES (?, ?)", rows)
+            self._db.commit()
+        except sqlite3.Error as e:
+            # 留到下一次落盘重试
+            self._dirty.update(channel_id for channel_id, _ in rows)
+            logger.error(f"❌ 保存转发进度失败: {e}")
+
+    async def run(self, interval=5.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+    def close(self):
+        self.flush()
+        if self._db is not None and self._owns_db:
+            self._db.close()
+        self._db = None
+
+CHECKPOINTS = CheckpointStore(CONFIG.get("backfill", {}).get("path", "forward_state.db"))
+
+# 持久化发件箱
+class Outbox:
+    """接收与投递之间的持久化发件箱（SQLite WAL）：至少一次投递、按投递键去重、失败按指数退避重试。
+
+    投递键见 delivery_key：同一条源消息发往多个目标时，每个目标单独登记、去重与重试（message_id 列保存的就是投递键）。
+
+    写入先进入当前事务，由 run() 每隔 flush_interval 批量提交，避免每条消息一次 fsync。
+    """
+
+    PENDING = "pending"
+    DONE = "done"
+    DEAD = "dead"
+
+    def __init__(self, path="forward_state.db", max_attempts=5, base_delay=2.0, max_delay=300.0,
+                 flush_interval=0.2, retention=3 * 86400):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._db = None
+        self._dirty = False
+        self._attempts = {}
+        self._replay = []  # open() 时的待投递快照，由 take_replay() 取走一次
+        self.depth = 0
+        self.duplicates = 0
+        self.retries = 0
+        self.delivered = 0
+        self.dead = 0
+
+    def open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "message_id TEXT PRIMARY KEY, channel_id TEXT NOT NULL, payload TEXT, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status)")
+        self._db.execute(
+            "DELETE FROM outbox WHERE status != ? AND updated_at < ?", (self.PENDING, time.time() - self.retention)
+        )
+        self._db.commit()
+        self.depth = self._db.execute("SELECT COUNT(*) FROM outbox WHERE status = ?", (self.PENDING,)).fetchone()[0]
+        # 必须在监听账号连上网关之前取快照：就绪前收到的实时消息也会登记为 pending，不能再被重放一次
+        self._replay = self.pending()
+        return self
+
+    def add(self, channel_id, message_id, payload):
+        """登记一条待投递消息；已登记过（去重）时返回 False"""
+        if self._db is None:
+            return True
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO outbox (message_id, channel_id, payload, status, attempts, updated_at) "
+            "VALUES (?, ?, ?, ?, 0, ?)",
+            (str(message_id), channel_id, json.dumps(payload, ensure_ascii=False) if payload else None,
+             self.PENDING, time.time()),
+        )
+        self._dirty = True
+        if cursor.rowcount != 1:
+            self.duplicates += 1
+            return False
+        self.depth += 1
+        return True
+
+    def _set_status(self, message_id, status, attempts):
+        if self._db is None:
+            return
+        self._db.execute(
+            "UPDATE outbox SET status = ?, attempts = ?, updated_at = ? WHERE message_id = ?",
+            (status, attempts, time.time(), str(message_id)),
+        )
+        self._dirty = True
+
+    def done(self, message_id):
+        attempts = self._attempts.pop(str(message_id), 0)
+        self._set_status(message_id, self.DONE, attempts)
+        self.depth -= 1
+        self.delivered += 1
+
+    def abandon(self, message_id):
+        """直接转入死信"""
+        self._set_status(message_id, self.DEAD, self._attempts.pop(str(message_id), 0))
+        self.depth -= 1
+        self.dead += 1
+
+    def retry(self, message_id):
+        """记录一次失败，返回下次重试前的等待秒数；超过最大次数时转入死信并返回 None"""
+        key = str(message_id)
+        attempts = self._attempts.get(key, 0) + 1
+        if attempts >= self.max_attempts:
+            self._attempts[key] = attempts
+            self.abandon(message_id)
+            return None
+        self._attempts[key] = attempts
+        self._set_status(message_id, self.PENDING, attempts)
+        self.retries += 1
+        return min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+
+    def pending(self):
+        """返回上次运行遗留的待投递消息 [(message_id, channel_id, payload)]，按登记顺序"""
+        if self._db is None:
+            return []
+        rows = self._db.execute(
+            "SELECT message_id, channel_id, payload, attempts FROM outbox WHERE status = ? ORDER BY rowid",
+            (self.PENDING,),
+        ).fetchall()
+        result = []
+        for message_id, channel_id, payload, attempts in rows:
+            self._attempts[message_id] = attempts
+            result.append((message_id, channel_id, json.loads(payload) if payload else None))
+        return result
+
+    def take_replay(self):
+        """取出 open() 时上次运行遗留的待投递消息，只有第一次调用返回内容"""
+        replay, self._replay = self._replay, []
+        return replay
+
+    def flush(self):
+        if self._db is not None and self._dirty:
+            self._dirty = False
+            try:
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._dirty = True
+                logger.error(f"❌ 发件箱提交失败: {e}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    @property
+    def connection(self):
+        return self._db
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "delivered": self.delivered,
+            "retries": self.retries,
+            "dead": self.dead,
+            "duplicates": self.duplicates,
+        }
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+def delivery_key(message_id, target_id):
+    return f"{message_id}:{target_id}"
+
+_outbox_config = CONFIG.get("outbox", {})
+OUTBOX = Outbox(
+    path=_outbox_config.get("path", "forward_state.db"),
+    max_attempts=_outbox_config.get("max_attempts", 5),
+    base_delay=_outbox_config.get("base_delay", 2.0),
+    max_delay=_outbox_config.get("max_delay", 300.0),
+    flush_interval=_outbox_config.get("flush_interval", 0.2),
+)
+
+async def fetch_messages_after(channel_id, after_id, token, limit=100):
+    """获取某消息之后的一页消息（按ID升序），遇到 429 时按 retry_after 等待后重试"""
+    url = f"https://discord.com/api/v10/channels/{channel_id}/messages?after={after_id}&limit={limit}"
+    headers = {"Authorization": token}
+    route_key = f"messages:{channel_id}"
+    session = await HTTP_POOL.get_session()
+    while True:
+        await BACKFILL_LIMITER.acquire(route_key)
+        async with session.get(url, headers=headers) as response:
+            if response.status == 200:
+                messages = await response.json()
+                return sorted(messages, key=lambda m: int(m['id']))
+            if response.status == 429:
+                data = await response.json()
+                BACKFILL_LIMITER.block(route_key, float(data.get('retry_after', BACKFILL_LIMITER.per)))
+                continue
+            logger.error(f"补发获取频道 {channel_id} 消息失败: {response.status}")
+            return None
+
+class Backfiller:
+    """监听账号重连或重启后，按频道从检查点开始分页补齐断线期间的消息"""
+
+    def __init__(self, concurrency=3, max_messages=1000):
+        self.concurrency = concurrency
+        self.max_messages = max_messages
+        self.buffers = {}  # 正在补发的频道 -> 补发期间收到的实时消息
+        self.backfilled = 0
+
+    def is_backfilling(self, channel_id):
+        return channel_id in self.buffers
+
+    def hold(self, channel_ids):
+        """监听账号连上网关之前调用：有检查点的频道先缓存实时消息，直到该频道补发完成，避免实时消息抢在断线积压之前转发"""
+        for channel_id in channel_ids:
+            if CHECKPOINTS.get(channel_id):
+                self.buffers.setdefault(channel_id, [])
+
+    def buffer(self, channel_id, message_id, enqueue):
+        """补发期间的实时消息先缓存，补发完成后按顺序入队"""
+        self.buffers[channel_id].append((int(message_id), enqueue))
+
+    async def run(self, routes, token, handle_payload):
+        """并发补发所有有检查点的频道；handle_payload(targets, payload) 负责把消息放入转发队列"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = [(source_id, targets) for source_id, targets in routes.items() if CHECKPOINTS.get(source_id)]
+        for source_id, _ in pending:
+            self.buffers.setdefault(source_id, [])
+
+        async def one(source_id, targets):
+            async with semaphore:
+                await self._backfill_channel(source_id, targets, token, handle_payload)
+
+        await asyncio.gather(*(one(*item) for item in pending), return_exceptions=True)
+
+    async def _backfill_channel(self, channel_id, targets, token, handle_payload):
+        after_id = CHECKPOINTS.get(channel_id)
+        count = 0
+        try:
+            while count < self.max_messages:
+                page = await fetch_messages_after(channel_id, after_id, token)
+                if not page:
+                    break
+                for payload in page:
+                    await handle_payload(targets, payload)
+                count += len(page)
+                after_id = int(page[-1]['id'])
+                if len(page) < 100:
+                    break
+            if count >= self.max_messages:
+                logger.warning(f"⚠️ 频道 {channel_id} 断线积压超过 {self.max_messages} 条，其余消息不再补发")
+            if count:
+                self.backfilled += count
+                logger.info(f"📥 频道 {channel_id} 已补发 {count} 条断线期间的消息")
+        except Exception as e:
+            logger.error(f"❌ 频道 {channel_id} 补发失败: {e}")
+        finally:
+            # 补发期间的实时消息按顺序入队，已被补发覆盖的跳过
+            for message_id, enqueue in self.buffers.pop(channel_id, []):
+                if after_id is None or message_id > after_id:
+                    await enqueue()
+
+_backfill_config = CONFIG.get("backfill", {})
+BACKFILL_LIMITER = RouteRateLimiter(rate=5, per=5.0)
+BACKFILLER = Backfiller(
+    concurrency=_backfill_config.get("concurrency", 3),
+    max_messages=_backfill_config.get("max_messages", 1000),
+)
+
+# Embed 标准化
+EMBED_EMPTY = "empty"
+EMBED_TEXTUAL = "textual"
+EMBED_IMAGE_ONLY = "image_only"
+EMBED_NESTED = "nested"
+
+# 嵌套型 embeds：embed 字典出现额外的 message/messages/embeds 字段，或 description 疑似JSON并包含这些字段
+NESTED_EMBED_KEYS = ("embeds", "message", "messages")
+NESTED_DESCRIPTION_KEYS = NESTED_EMBED_KEYS + ("content",)
+
+def _description_is_nested(description):
+    if not isinstance(description, str):
+        return False
+    stripped = description.lstrip()
+    if not stripped or stripped[0] not in "{[":
+        return False
+    try:
+        parsed = json.loads(stripped)
+    except ValueError:
+        return False
+    return isinstance(parsed, dict) and any(k in parsed for k in NESTED_DESCRIPTION_KEYS)
+
+def classify_embed_dict(data):
+    """对原始 embed 字典分类：nested / textual / image_only / empty"""
+    if any(k in data for k in NESTED_EMBED_KEYS) or _description_is_nested(data.get("description")):
+        return EMBED_NESTED
+    if data.get("title") or data.get("description") or data.get("fields"):
+        return EMBED_TEXTUAL
+    if (data.get("image") or {}).get("url"):
+        return EMBED_IMAGE_ONLY
+    return EMBED_EMPTY
+
+def classify_embed(embed):
+    """对 discord.Embed 对象分类，不经过 to_dict/from_dict"""
+    if _description_is_nested(embed.description):
+        return EMBED_NESTED
+    if embed.title or embed.description or embed.fields:
+        return EMBED_TEXTUAL
+    if getattr(embed.image, 'url', None):
+        return EMBED_IMAGE_ONLY
+    return EMBED_EMPTY
+
+class NormalizedMessage:
+    """标准化后的消息：内容、embeds、附件，以及每个 embed 的分类（只计算一次，后续阶段直接复用）"""
+
+    __slots__ = ("content", "embeds", "attachments", "kinds")
+
+    def __init__(self, content, embeds, attachments, kinds):
+        self.content = content
+        self.embeds = embeds
+        self.attachments = attachments
+        self.kinds = kinds
+
+    @property
+    def nested(self):
+        return EMBED_NESTED in self.kinds
+
+    @property
+    def image_only(self):
+        return bool(self.kinds) and all(kind == EMBED_IMAGE_ONLY for kind in self.kinds)
+
+    @property
+    def has_text(self):
+        return bool(self.content and self.content.strip()) or EMBED_TEXTUAL in self.kinds
+
+def _payload_source(data):
+    """content 为空时依次回退到被引用消息、转发快照"""
+    if (data.get('content') or '').strip():
+        return data
+    if data.get('referenced_message'):
+        return data['referenced_message']
+    snapshots = data.get('message_snapshots') or []
+    if snapshots and snapshots[0].get('message'):
+        return snapshots[0]['message']
+    return data
+
+def normalize_payload(message_data):
+    """从 API / 网关原始消息数据（两者结构相同）一次性构建 NormalizedMessage"""
+    source = _payload_source(message_data)
     embeds = []
-    attachments = []
+    kinds = []
     
-    # 处理 embeds
-    for embed_data in message_data.get('embeds', []):
+    # 处理 embeds：分类与构建在同一次遍历中完成
+    for embed_data in source.get('embeds') or []:
         try:
-            embed = discord.Embed.from_dict(embed_data)
-            embeds.append(embed)
+            embeds.append(discord.Embed.from_dict(embed_data))
         except Exception as e:
             logger.error(f"处理 embed 失败: {e}")
+            continue
+        kinds.append(classify_embed_dict(embed_data))
     
     # 处理 attachments
-    for attachment_data in message_data.get('attachments', []):
-        try:
-            attachment = discord.File(attachment_data.get('url', ''), filename=attachment_data.get('filename', 'unknown'))
-            attachments.append(attachment)
-        except Exception as e:
-            logger.error(f"处理 attachment 失败: {e}")
+    attachments = []
+    for attachment_data in source.get('attachments') or []:
+        if attachment_data.get('url'):
+            attachments.append(RawAttachment(
+                attachment_data['url'],
+                attachment_data.get('filename', 'unknown'),
+                attachment_data.get('size'),
+            ))
     
-    return content, embeds, attachments
+    return NormalizedMessage(source.get('content') or '', embeds, attachments, kinds)
+
+def normalize_model(message):
+    """从 selfcord 的 Message 对象构建 NormalizedMessage（网关原始数据缺失时使用）"""
+    source = message
+    if not (message.content or '').strip():
+        reference = getattr(message, 'reference', None)
+        resolved = getattr(reference, 'resolved', None)
+        snapshots = getattr(message, 'message_snapshots', None)
+        if resolved is not None and hasattr(resolved, 'content'):
+            source = resolved
+        elif snapshots:
+            source = snapshots[0]
+    embeds = list(getattr(source, 'embeds', None) or [])
+    kinds = [classify_embed(e) for e in embeds]
+    attachments = list(getattr(source, 'attachments', None) or [])
+    return NormalizedMessage(getattr(source, 'content', '') or '', embeds, attachments, kinds)
+
+class FanoutJob:
+    """一条源消息发往多个目标时共享的处理结果：标准化、附件下载、每种翻译设置的翻译都只做一次，
+    成本随不同语言的数量而不是目标数量增长；最后一个目标处理完后释放附件"""
+
+    def __init__(self, message, raw, message_id, targets):
+        self.message = message
+        self.raw = raw
+        self.message_id = message_id
+        self.remaining = targets
+        self.created = time.monotonic()
+        self.stack = contextlib.AsyncExitStack()
+        self._tasks = {}
+
+    async def once(self, key, factory):
+        """同一 key 的工作只执行一次，其他目标等待同一个结果"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+        return await asyncio.shield(task)
+
+    async def release(self):
+        self.remaining -= 1
+        if self.remaining > 0:
+            return
+        for task in self._tasks.values():
+            task.cancel()
+        await self.stack.aclose()
+
+# 监听账号池
+def listener_tokens(config):
+    """监听账号 token 列表：主账号 listener_token 在前，其后是 listener_tokens 中的其他账号（去重）"""
+    tokens = [config.get("listener_token")] + list(config.get("listener_tokens") or [])
+    return list(dict.fromkeys(t.strip() for t in tokens if t and t.strip()))
+
+class ListenerPool:
+    """多个监听账号分担源频道：按分片策略为每个频道指定首选账号；首选账号掉线时由下一个在线账号临时接管（热备），
+    恢复后交还。多个账号都能看到的频道只由当前负责的账号处理，并按消息ID去重"""
+
+    STRATEGIES = ("hash", "round_robin")
+
+    def __init__(self, strategy="hash", failover=True, seen_limit=5000):
+        if strategy not in self.STRATEGIES:
+            logger.error(f"❌ 未知的分片策略 {strategy}，改用 hash")
+            strategy = "hash"
+        self.strategy = strategy
+        self.failover = failover
+        self.seen_limit = seen_limit
+        self.listeners = []  # MySelfcordClient，下标即账号序号
+        self.online = set()
+        self.assignment = {}  # 源频道ID -> 首选账号序号
+        self._seen = OrderedDict()
+        self.duplicates = 0
+        self.failovers = 0
+
+    def add(self, listener):
+        listener.index = len(self.listeners)
+        self.listeners.append(listener)
+
+    def assign(self, channel_mapping):
+        """按策略分配源频道；映射中的 listener 字段可指定账号序号"""
+        self.assignment = self.plan(channel_mapping)
+
+    def plan(self, channel_mapping):
+        """计算分配结果但不生效"""
+        count = len(self.listeners) or 1
+        assignment = {}
+        for i, channel_id in enumerate(sorted(channel_mapping, key=int)):
+            pinned = channel_mapping[channel_id].get("listener")
+            if isinstance(pinned, int):
+                assignment[channel_id] = pinned % count
+            elif self.strategy == "round_robin":
+                assignment[channel_id] = i % count
+            else:
+                # 雪花ID的低位是自增序号，分布不均，先做一次哈希
+                assignment[channel_id] = int(hashlib.md5(channel_id.encode()).hexdigest(), 16) % count
+        return assignment
+
+    def owner(self, channel_id):
+        """当前负责该频道的账号序号：首选账号在线时为首选，否则为其后第一个在线账号"""
+        preferred = self.assignment.get(channel_id)
+        if preferred is None or preferred in self.online or not self.failover:
+            return preferred
+        count = len(self.listeners)
+        for step in range(1, count):
+            candidate = (preferred + step) % count
+            if candidate in self.online:
+                return candidate
+        return preferred
+
+    def owned(self, index):
+        return [channel_id for channel_id in self.assignment if self.owner(channel_id) == index]
+
+    def claim(self, message_id):
+        """登记一条消息，已被其他账号处理过时返回 False"""
+        message_id = str(message_id)
+        if message_id in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen[message_id] = None
+        while len(self._seen) > self.seen_limit:
+            self._seen.popitem(last=False)
+        return True
+
+    def set_online(self, index, online):
+        """更新账号在线状态，返回负责账号因此发生变化的频道 {频道ID: 新账号序号}"""
+        before = {channel_id: self.owner(channel_id) for channel_id in self.assignment}
+        if online:
+            self.online.add(index)
+        else:
+            self.online.discard(index)
+        return {
+            channel_id: self.owner(channel_id)
+            for channel_id, previous in before.items()
+            if self.owner(channel_id) != previous
+        }
+
+    def handover(self, changed):
+        """把接管的频道交给新的负责账号，从检查点补发交接期间的消息"""
+        by_owner = {}
+        for channel_id, index in changed.items():
+            by_owner.setdefault(index, []).append(channel_id)
+        for index, channel_ids in by_owner.items():
+            listener = self.listeners[index]
+            logger.info(f"🔀 监听账号 #{index} 接管 {len(channel_ids)} 个频道")
+            listener._spawn(listener.backfill(channel_ids))
+        self.failovers += len(changed)
+
+    def stats(self):
+        return {
+            "listeners": len(self.listeners),
+            "online": len(self.online),
+            "channels": {index: len(self.owned(index)) for index in range(len(self.listeners))},
+            "duplicates": self.duplicates,
+            "failovers": self.failovers,
+        }
+
+_listener_config = CONFIG.get("listeners", {})
+
+def listener_client_options(config):
+    """监听账号的内存受限配置：少量或不缓存消息、不缓存成员、启动时不分块拉取成员列表"""
+    max_messages = config.get("max_messages", 0)
+    options = {
+        # 0 或 null 表示不缓存消息：转发只用网关原始数据，不依赖消息缓存
+        "max_messages": max_messages or None,
+        "chunk_guilds_at_startup": config.get("chunk_guilds", False),
+    }
+    member_cache_flags = getattr(selfcord, "MemberCacheFlags", None)
+    if member_cache_flags is not None and not config.get("member_cache", False):
+        options["member_cache_flags"] = member_cache_flags.none()
+    return options
+
+def memory_report(listeners=()):
+    """进程常驻内存与各监听账号的缓存规模"""
+    report = {"rss_mb": None}
+    try:
+        with open("/proc/self/statm") as f:
+            report["rss_mb"] = round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576, 1)
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            # 非 Linux 平台只能取到峰值（macOS 单位为字节，其余为 KB）
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report["rss_mb"] = round(peak / (1048576 if sys.platform == "darwin" else 1024), 1)
+        except ImportError:
+            pass
+    for listener in listeners:
+        report[f"listener#{listener.index}"] = {
+            "guilds": len(getattr(listener, "guilds", ())),
+            "users": len(getattr(listener, "users", ())),
+            "messages": len(getattr(listener, "cached_messages", ())),
+            "dropped_events": listener.dropped_events,
+        }
+    return report
+
+LISTENERS = ListenerPool(
+    strategy=_listener_config.get("strategy", "hash"),
+    failover=_listener_config.get("failover", True),
+)
 
 class MySelfcordClient(selfcord.Client):
-    def __init__(self, forwarder):
-        super().__init__()
+    RAW_PAYLOAD_LIMIT = _listener_config.get("raw_payload_limit", 500)
+    # 只对映射频道有意义的频道事件；其他频道的这些事件在构建模型对象之前直接丢弃
+    CHANNEL_EVENTS = (
+        "MESSAGE_UPDATE", "MESSAGE_DELETE", "MESSAGE_DELETE_BULK", "MESSAGE_ACK", "TYPING_START",
+        "MESSAGE_REACTION_ADD", "MESSAGE_REACTION_REMOVE", "MESSAGE_REACTION_REMOVE_ALL", "MESSAGE_REACTION_REMOVE_EMOJI",
+    )
+    PRESENCE_EVENTS = ("PRESENCE_UPDATE", "PRESENCES_REPLACE")
+
+    def __init__(self, forwarder, token=None):
+        try:
+            super().__init__(**listener_client_options(_listener_config))
+        except TypeError as e:
+            logger.warning(f"⚠️ 当前 selfcord 版本不支持缓存限制参数，使用默认配置: {e}")
+            super().__init__()
         self.forwarder = forwarder
+        self.dropped_events = 0
+        self.token = token or CONFIG.get("listener_token")
+        self.index = 0
+        # 监听频道的原始 MESSAGE_CREATE 数据，供标准化使用，避免再走 HTTP
+        self._raw_payloads = OrderedDict()
+        self._install_raw_hook()
+        self._retry_tasks = set()
+        self._created = time.monotonic()
+
+    def _install_raw_hook(self):
+        """包装网关的 MESSAGE_CREATE 解析器，在构建 Message 之前截获原始数据；
+        未映射（或不归本账号负责）频道的消息事件直接丢弃，不再构建任何模型对象"""
+        parsers = getattr(getattr(self, '_connection', None), 'parsers', None)
+        if not parsers or 'MESSAGE_CREATE' not in parsers:
+            logger.warning("⚠️ 无法挂载网关原始消息钩子，标准化将回退为按ID获取")
+            return
+        original = parsers['MESSAGE_CREATE']
+
+        def parse_message_create(data):
+            if self.wants(data.get('channel_id')):
+                self._raw_payloads[data.get('id')] = data
+                while len(self._raw_payloads) > self.RAW_PAYLOAD_LIMIT:
+                    self._raw_payloads.popitem(last=False)
+            elif _listener_config.get("drop_unmapped", True):
+                self.dropped_events += 1
+                return
+            return original(data)
+
+        parsers['MESSAGE_CREATE'] = parse_message_create
+        if not _listener_config.get("drop_unmapped", True):
+            return
+        for event in self.CHANNEL_EVENTS:
+            if event in parsers:
+                parsers[event] = self._channel_filter(parsers[event])
+        if _listener_config.get("drop_presences", True):
+            for event in self.PRESENCE_EVENTS:
+                if event in parsers:
+                    parsers[event] = self._drop
+
+    def _drop(self, data):
+        self.dropped_events += 1
+
+    def _channel_filter(self, parser):
+        def parse(data):
+            if not self.wants(data.get('channel_id')):
+                self.dropped_events += 1
+                return
+            return parser(data)
+        return parse
+
+    def wants(self, channel_id):
+        return channel_id in self.forwarder.routes and self.owns(channel_id)
+
+    def owns(self, channel_id):
+        """只处理分片给本账号（或本账号正在接管）的频道"""
+        return LISTENERS.owner(channel_id) in (None, self.index)
+
+    async def normalize(self, message, raw):
+        """标准化消息：优先使用网关原始数据；缺失且 embeds 为嵌套/仅图片时按消息ID精确获取"""
+        with METRICS.timer("normalize"):
+            if raw is not None:
+                return normalize_payload(raw)
+            normalized = normalize_model(message)
+            if not (normalized.nested or normalized.image_only):
+                return normalized
+            reason = "嵌套" if normalized.nested else "仅图片"
+            logger.info(f"检测到{reason} embeds 且缺少网关原始数据，通过HTTP获取频道 {message.channel.id} 消息 {message.id}")
+            payload = await get_message(message.channel.id, message.id, self.token)
+            if payload:
+                fetched = normalize_payload(payload)
+                # 嵌套型总是采用 HTTP 结果；仅图片型只有在 HTTP 结果提供了文本时才采用
+                if normalized.nested or fetched.has_text:
+                    return fetched
+            return normalized
     
     async def on_ready(self):
-        logger.info(f'🎧 监听客户端已登录: {self.user}')
-        logger.info('📡 开始监听指定频道...')
+        logger.info(f'🎧 监听客户端 #{self.index} 已登录: {self.user} (启动后 {time.monotonic() - self._created:.1f}s)')
+        LISTENERS.set_online(self.index, True)
+        logger.info(f'📡 开始监听指定频道: {len(LISTENERS.owned(self.index))} 个 | 内存: {memory_report([self])}')
+        # 发件箱只由第一个就绪的账号重放一次
+        await self._replay_outbox()
+        # 每次新建会话（重启或断线后无法 RESUME）都补发检查点之后的消息
+        await self.backfill(LISTENERS.owned(self.index))
+
+    async def on_resumed(self):
+        LISTENERS.set_online(self.index, True)
+
+    async def on_disconnect(self):
+        changed = LISTENERS.set_online(self.index, False)
+        if changed:
+            logger.warning(f"⚠️ 监听客户端 #{self.index} 网关断开，{len(changed)} 个频道交给热备账号")
+            LISTENERS.handover(changed)
+
+    async def backfill(self, channel_ids):
+        if not _backfill_config.get("enabled", True):
+            return
+        routes = {channel_id: self.forwarder.routes[channel_id] for channel_id in channel_ids if channel_id in self.forwarder.routes}
+        await BACKFILLER.run(routes, self.token, self._enqueue_payload)
+
+    async def _replay_outbox(self):
+        """重新投递上次运行未完成的消息；同一条消息的多个目标仍共享处理结果"""
+        pending = OUTBOX.take_replay()
+        if pending:
+            logger.info(f"📮 发件箱中有 {len(pending)} 条未完成的投递，重新投递")
+        grouped = OrderedDict()
+        for key, channel_id, payload in pending:
+            message_id, _, target_id = key.partition(":")
+            routes = self.forwarder.routes.get(channel_id) or []
+            # 旧版本登记的记录不带目标，当时每个源频道只有映射自身的一个目标
+            route = self.forwarder.find_route(channel_id, target_id) if target_id else (routes[0] if routes else None)
+            if route is None or payload is None:
+                # 路由已删除，或当时缺少原始数据无法重建消息
+                logger.warning(f"⚠️ 发件箱消息 {message_id} 无法重放，已放弃")
+                OUTBOX.abandon(key)
+                continue
+            grouped.setdefault(message_id, (payload, []))[1].append((route, key))
+        for message_id, (payload, deliveries) in grouped.items():
+            await self._dispatch(None, payload, message_id, deliveries)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _submit(self, targets, message, raw, message_id):
+        """按目标登记到发件箱（已处理过的目标直接跳过）后放入各目标的转发队列"""
+        if not LISTENERS.claim(message_id):
+            return
+        deliveries = []
+        for route in targets:
+            key = delivery_key(message_id, route.target_id)
+            if OUTBOX.add(route.source_id, key, raw):
+                deliveries.append((route, key))
+            else:
+                logger.info(f"消息 {message_id} 已在发件箱中 (目标: {route.target_id})，跳过重复投递")
+        if deliveries:
+            await self._dispatch(message, raw, message_id, deliveries)
+
+    async def _dispatch(self, message, raw, message_id, deliveries):
+        """各目标的投递共享同一个 FanoutJob，分别进入目标频道的转发队列，因此不同目标并发发送"""
+        job = FanoutJob(message, raw, message_id, len(deliveries))
+        for route, key in deliveries:
+            deliver = self._target_job(job, route, key)
+            if not await FORWARD_QUEUE.put(route.target_id, deliver):
+                OUTBOX.abandon(key)
+                await job.release()
+
+    def _target_job(self, job, route, key):
+        queued = time.monotonic()
+
+        async def deliver():
+            METRICS.observe("queue_wait", time.monotonic() - queued)
+            await self._deliver(job, route, key)
+
+        # 被 drop_oldest 策略丢弃时转入死信，并释放共享的附件
+        def on_drop():
+            OUTBOX.abandon(key)
+            self._spawn(job.release())
+
+        deliver.on_drop = on_drop
+        return deliver
+
+    async def _deliver(self, job, route, key):
+        try:
+            handled = await self.process_message(job, route)
+        finally:
+            await job.release()
+        if handled:
+            OUTBOX.done(key)
+            # 补发与重放的消息等待时间不代表转发延迟，只统计实时消息
+            if job.message is not None:
+                METRICS.observe("end_to_end", time.monotonic() - job.created)
+            return
+        delay = OUTBOX.retry(key)
+        if delay is None:
+            logger.error(f"❌ 消息 {job.message_id} 发往 {route.target_id} 重试 {OUTBOX.max_attempts} 次仍失败，已放弃")
+            return
+        logger.warning(f"⚠️ 消息 {job.message_id} 发往 {route.target_id} 投递失败，{delay:.0f}s 后重试")
+
+        async def retry_later():
+            await asyncio.sleep(delay)
+            await self._dispatch(job.message, job.raw, job.message_id, [(route, key)])
+
+        self._spawn(retry_later())
+
+    async def _enqueue_payload(self, targets, payload):
+        author_id = str((payload.get('author') or {}).get('id'))
+        allowed = [route for route in targets if route.allows_author(author_id)]
+        if not allowed:
+            CHECKPOINTS.advance(targets[0].source_id, payload['id'])
+            return
+        await self._submit(allowed, None, payload, payload['id'])
 
     async def on_message(self, message):
+        """只做轻量判断后入队，标准化、翻译与发送都在目标频道的 worker 中进行"""
+        raw = self._raw_payloads.pop(str(message.id), None)
         channel_id = str(message.channel.id)
+        routes = self.forwarder.routes.get(channel_id)
+        if not routes or not self.owns(channel_id):
+            return
+        METRICS.inc("received_messages", (channel_id,))
+        with METRICS.timer("on_message"):
+            await self._accept(message, raw, channel_id, routes)
+
+    async def _accept(self, message, raw, channel_id, routes):
+        # 用户过滤最便宜，入队前就丢弃
         author_id = str(message.author.id)
-        content = message.content
-        # embed 转换：to_dict/from_dict
-        embeds = []
-        attachments = message.attachments if hasattr(message, 'attachments') else []
-        embed_conversion_failed = False
-
-        # 先处理主消息上的 embeds（非引用、非快照）
-        if hasattr(message, 'embeds') and message.embeds:
-            try:
-                # 原始字典用于判定是否为“嵌套型”结构
-                raw_embed_dicts = []
-                converted = []
-                for e in message.embeds:
-                    raw = e.to_dict()
-                    raw_embed_dicts.append(raw)
-                    converted.append(discord.Embed.from_dict(raw))
-                embeds = converted
-                # 嵌套型 embeds 识别：embed 字典出现额外的 message/messages/embeds 字段，
-                # 或 description 疑似JSON并包含上述字段
-                suspect_nested = False
-                for raw in raw_embed_dicts:
-                    if any(k in raw for k in ("embeds", "message", "messages")):
-                        suspect_nested = True
-                        break
-                    desc = raw.get("description")
-                    if isinstance(desc, str) and (desc.strip().startswith("{") or desc.strip().startswith("[")):
-                        try:
-                            parsed = json.loads(desc)
-                            if isinstance(parsed, dict) and any(k in parsed for k in ("embeds", "message", "messages", "content")):
-                                suspect_nested = True
-                                break
-                        except Exception:
-                            pass
-                if suspect_nested:
-                    embed_conversion_failed = True
-                    logger.info("检测到疑似嵌套型 embeds（主消息）")
-            except Exception as ex:
-                embed_conversion_failed = True
-                embeds = []
-                logger.error(f"Embed 转换失败(主消息): {ex}")
-
-        # 自动修正：如果 content 为空，优先尝试从引用消息或 message_snapshots 提取内容和 embed
-        if not content.strip():
-            # 1. Discord.py 的 message.reference
-            if hasattr(message, 'reference') and message.reference and hasattr(message.reference, 'resolved') and message.reference.resolved:
-                ref = message.reference.resolved
-                content = ref.content
-                if hasattr(ref, 'embeds'):
-                    try:
-                        embeds = [discord.Embed.from_dict(e.to_dict()) for e in ref.embeds]
-                    except Exception as ex:
-                        logger.error(f"Embed 转换失败: {ex}")
-                if hasattr(ref, 'attachments'):
-                    attachments = ref.attachments
-            # 2. 如果有 message_snapshots（自定义结构），也可以解析
-            elif hasattr(message, 'message_snapshots') and message.message_snapshots:
-                snap = message.message_snapshots[0]
-                logger.error(f"message_snapshots[0] dir: {dir(snap)}")
-                logger.error(f"message_snapshots[0] dict: {getattr(snap, '__dict__', {})}")
-                content = getattr(snap, 'content', '')
-                embeds = []
-                if hasattr(snap, 'embeds'):
-                    raw_embed_dicts = []
-                    for e in snap.embeds:
-                        try:
-                            raw = e.to_dict()
-                            raw_embed_dicts.append(raw)
-                            embeds.append(discord.Embed.from_dict(raw))
-                        except Exception as ex:
-                            embed_conversion_failed = True
-                            logger.error(f"Embed 转换失败: {ex}")
-                    # 嵌套型 embeds 判定（快照）
-                    if raw_embed_dicts:
-                        suspect_nested = False
-                        for raw in raw_embed_dicts:
-                            if any(k in raw for k in ("embeds", "message", "messages")):
-                                suspect_nested = True
-                                break
-                            desc = raw.get("description")
-                            if isinstance(desc, str) and (desc.strip().startswith("{") or desc.strip().startswith("[")):
-                                try:
-                                    parsed = json.loads(desc)
-                                    if isinstance(parsed, dict) and any(k in parsed for k in ("embeds", "message", "messages", "content")):
-                                        suspect_nested = True
-                                        break
-                                except Exception:
-                                    pass
-                        if suspect_nested:
-                            embed_conversion_failed = True
-                            logger.info("检测到疑似嵌套型 embeds（快照）")
-                if hasattr(snap, 'attachments'):
-                    attachments = snap.attachments
-            # 注意：按需触发 HTTP 获取仅在 embeds 异常时进行，已在下方 embed_conversion_failed 分支处理
-
-        # 如果检测到嵌套/异常 embeds（任一转换失败），也走 HTTP 标准化获取
-        if embed_conversion_failed:
-            logger.info(f"检测到嵌套/异常 embed，尝试通过HTTP获取频道 {channel_id} 最新消息进行标准化")
-            latest_message = await get_latest_message(channel_id, CONFIG['listener_token'])
-            if latest_message:
-                content, embeds, attachments = process_api_message(latest_message)
-                logger.info(f"因嵌套embed，已通过HTTP标准化处理频道 {channel_id} 最新消息")
-
-        # 如果 embeds 存在但没有可发送的文本字段（仅图片等），也触发 HTTP 标准化获取
-        if not embed_conversion_failed and embeds:
-            try:
-                only_image_embeds = bool(embeds) and all(
-                    (not getattr(e, 'title', None)) and
-                    (not getattr(e, 'description', None)) and
-                    (not getattr(e, 'fields', [])) and
-                    getattr(getattr(e, 'image', None), 'url', None)
-                    for e in embeds
+        targets = [route for route in routes if route.allows_author(author_id)]
+        if not targets:
+            CHECKPOINTS.advance(channel_id, message.id)
+            return
+
+        async def enqueue():
+            await self._submit(targets, message, raw, str(message.id))
+
+        if BACKFILLER.is_backfilling(channel_id):
+            BACKFILLER.buffer(channel_id, message.id, enqueue)
+            return
+        await enqueue()
+
+    async def process_message(self, job, route):
+        """把消息发往单个目标；job.message 为 None 时（补发、发件箱重放）只使用原始数据。返回是否已处理完毕"""
+        if job.message is not None:
+            author_id = str(job.message.author.id)
+            content = job.message.content
+        else:
+            author_id = str((job.raw.get('author') or {}).get('id'))
+            content = job.raw.get('content') or ''
+        handled = await self._process(job, route, author_id, content)
+        if handled:
+            CHECKPOINTS.advance(route.source_id, job.message_id)
+        return handled
+
+    @staticmethod
+    async def _translate(content, embeds, translate_config, api_key):
+        embeds = list(embeds)
+        with METRICS.timer("translate"):
+            content = await translate_message(content, embeds, translate_config, api_key)
+        return content, embeds
+
+    async def _download(self, job, attachments):
+        return SharedAttachments(await self.forwarder.download_attachments(job.stack, attachments))
+
+    async def _process(self, job, route, author_id, content):
+        """返回 True 表示消息已处理完毕（已转发或被过滤），可以推进检查点"""
+        message, raw = job.message, job.raw
+        channel_id = route.source_id
+        # 消息自带文本时先做关键字过滤，被排除的消息不再做 embed 转换、标准化和翻译
+        prefiltered = None
+        if content.strip():
+            prefiltered = route.keywords.process(content)
+            if prefiltered is None:
+                METRICS.inc("forwarded_messages", (route.source_id, route.target_id, "filtered"))
+                return True
+        original_content = content
+        # 标准化、翻译与附件下载在同一条消息的所有目标之间共享
+        normalized = await job.once("normalize", lambda: self.normalize(message, raw))
+        content, embeds = normalized.content, normalized.embeds
+
+        if prefiltered is not None and content == original_content:
+            content = prefiltered
+        else:
+            # 文本来自引用或转发快照，需要重新过滤
+            content = route.keywords.process(content)
+            if content is None:
+                METRICS.inc("forwarded_messages", (route.source_id, route.target_id, "filtered"))
+                return True
+
+        # 检查是否需要翻译；相同文本与翻译设置的目标只翻译一次
+        if route.translate_enabled:
+            api_key = CONFIG.get("geekai_api_key", "")
+            if api_key:
+                key = ("translate", content, json.dumps(route.translate, sort_keys=True))
+                content, embeds = await job.once(
+                    key, lambda text=content: self._translate(text, normalized.embeds, route.translate, api_key)
                 )
-            except Exception:
-                only_image_embeds = False
-            if only_image_embeds:
-                logger.info(f"检测到仅图片 embeds，尝试通过HTTP获取频道 {channel_id} 最新消息进行标准化")
-                latest_message = await get_latest_message(channel_id, CONFIG['listener_token'])
-                if latest_message:
-                    api_content, api_embeds, api_attachments = process_api_message(latest_message)
-                    # 若HTTP结果提供了文本或更丰富的embed，则采用之，否则保留原始
-                    has_textual_embed = any(
-                        getattr(e, 'title', None) or getattr(e, 'description', None) or getattr(e, 'fields', [])
-                        for e in api_embeds
-                    )
-                    if (api_content and api_content.strip()) or has_textual_embed:
-                        content, embeds, attachments = api_content, api_embeds, api_attachments
-                        logger.info(f"因仅图片 embeds，已通过HTTP标准化处理频道 {channel_id} 最新消息")
-
-        if channel_id in CONFIG["channel_mapping"]:
-            if not should_forward_message(content, author_id):
-                return
-            content = replace_keywords(content)
-            
-            # 检查是否需要翻译
-            translate_config = get_translate_config(channel_id)
-            if translate_config.get("enabled", False):
-                target_language = translate_config.get("target_language", "chinese")
-                model = translate_config.get("model", "gpt-4o-mini")
-                api_key = CONFIG.get("geekai_api_key", "")
-                
-                if api_key:
-                    # 翻译消息内容
-                    if content.strip():
-                        logger.info(f"开始翻译消息内容: {content[:50]}... (模型: {model})")
-                        translated_content = await translate_text(content, target_language, api_key, model)
-                        if translated_content != content:
-                            content = translated_content
-                            logger.info(f"消息内容已翻译为{target_language}")
-                    
-                    # 翻译 embeds 中的文本内容
-                    if embeds:
-                        logger.info(f"开始翻译 {len(embeds)} 个 embeds (模型: {model})")
-                        for i, embed in enumerate(embeds):
-                            # 翻译 title
-                            if hasattr(embed, 'title') and embed.title:
-                                try:
-                                    translated_title = await translate_text(embed.title, target_language, api_key, model)
-                                    if translated_title != embed.title:
-                                        embed.title = translated_title
-                                        logger.info(f"Embed {i+1} title 已翻译为{target_language}")
-                                except Exception as e:
-                                    logger.error(f"翻译 Embed {i+1} title 失败: {e}")
-                            
-                            # 翻译 description
-                            if hasattr(embed, 'description') and embed.description:
-                                try:
-                                    translated_desc = await translate_text(embed.description, target_language, api_key, model)
-                                    if translated_desc != embed.description:
-                                        embed.description = translated_desc
-                                        logger.info(f"Embed {i+1} description 已翻译为{target_language}")
-                                except Exception as e:
-                                    logger.error(f"翻译 Embed {i+1} description 失败: {e}")
-                            
-                            # 翻译 fields
-                            if hasattr(embed, 'fields') and embed.fields:
-                                for j, field in enumerate(embed.fields):
-                                    # 翻译 field name
-                                    if hasattr(field, 'name') and field.name:
-                                        try:
-                                            translated_name = await translate_text(field.name, target_language, api_key, model)
-                                            if translated_name != field.name:
-                                                field.name = translated_name
-                                                logger.info(f"Embed {i+1} field {j+1} name 已翻译为{target_language}")
-                                        except Exception as e:
-                                            logger.error(f"翻译 Embed {i+1} field {j+1} name 失败: {e}")
-                                    
-                                    # 翻译 field value
-                                    if hasattr(field, 'value') and field.value:
-                                        try:
-                                            translated_value = await translate_text(field.value, target_language, api_key, model)
-                                            if translated_value != field.value:
-                                                field.value = translated_value
-                                                logger.info(f"Embed {i+1} field {j+1} value 已翻译为{target_language}")
-                                        except Exception as e:
-                                            logger.error(f"翻译 Embed {i+1} field {j+1} value 失败: {e}")
-                        
-                        logger.info(f"所有 embeds 翻译完成")
-            
-            logger.info(f"📨 收到来自频道 {channel_id} 的消息: {content[:50]}... (用户: {author_id})")
-            if attachments:
-                logger.info(f"📎 发现 {len(attachments)} 个附件")
+
+        logger.info(f"📨 收到来自频道 {channel_id} 的消息: {content[:50]}... (用户: {author_id}, 目标: {route.target_id})")
+        attachments = None
+        if normalized.attachments:
+            logger.info(f"📎 发现 {len(normalized.attachments)} 个附件")
+            attachments = await job.once("attachments", lambda: self._download(job, normalized.attachments))
+        if message is not None:
             author_name = message.author.display_name if hasattr(message.author, 'display_name') else str(message.author)
-            await self.forwarder.forward_message(channel_id, content, author_name, attachments, embeds)
+        else:
+            author = raw.get('author') or {}
+            author_name = author.get('global_name') or author.get('username') or "未知用户"
+        with METRICS.timer("forward"):
+            sent = await self.forwarder.forward_message(
+                route, content, author_name, attachments, embeds, normalized.image_only,
+                author_avatar_url(message, raw),
+            )
+        METRICS.inc("forwarded_messages", (route.source_id, route.target_id, "ok" if sent else "failed"))
+        return sent
 
 class MyDiscordClient(discord.Client):
     def __init__(self, intents, token=None):
@@ -471,10 +2861,13 @@ class MyDiscordClient(discord.Client):
     async def on_ready(self):
         logger.info(f'🤖 转发机器人已登录: {self.user}')
         logger.info('✅ 转发机器人准备就绪!')
-        for source_id, mapping in CONFIG["channel_mapping"].items():
-            target_channel = self.get_channel(int(mapping["target"]))
-            if not target_channel:
-                logger.error(f"❌ 目标频道 {mapping['target']} 不可用")
+        if self.forwarder:
+            self.forwarder.invalidate_channels(self)
+            for routes in self.forwarder.routes.values():
+                for route in routes:
+                    if route.client is self and not route.target_channel():
+                        logger.error(f"❌ 目标频道 {route.target_id} 不可用")
+            self.forwarder.notify_routes()
 
     async def on_message(self, message):
         # 机器人不响应自己的消息
@@ -497,11 +2890,199 @@ async def start_discord_bot(client, token, user_id_to_client, token_to_user_id):
 def start_selfcord(selfcord_client):
     async def _start():
         try:
-            await selfcord_client.start(CONFIG["listener_token"])
+            await selfcord_client.start(selfcord_client.token)
         except Exception as e:
-            logger.error(f"❌ 监听账号登录失败: {e}")
+            logger.error(f"❌ 监听账号 #{selfcord_client.index} 登录失败: {e}")
     return _start()
 
+# 机器人管理与配置热加载
+# 启动编排
+_startup_config = CONFIG.get("startup", {})
+# 目标机器人未就绪时，转发最多等待的秒数
+BOT_READY_TIMEOUT = float(_startup_config.get("ready_timeout", 60))
+
+class BotManager:
+    """按 token 管理转发机器人：配置变更时增量启动新机器人、关闭被移除的机器人，其余连接保持不动。
+    新机器人并发登录，同时登录的数量受 concurrency 限制，建立网关会话（IDENTIFY）受令牌桶限制"""
+
+    def __init__(self, forwarder, intents, concurrency=None, identify_rate=None, identify_per=None):
+        self.forwarder = forwarder
+        self.intents = intents
+        self.clients = {}  # token -> MyDiscordClient
+        self.tasks = {}  # token -> connect 任务
+        self.starting = set()  # 正在启动的 token
+        self._sync_tasks = set()
+        self._slots = asyncio.Semaphore(concurrency or _startup_config.get("concurrency", 5))
+        self._identify = RouteRateLimiter(
+            rate=identify_rate or _startup_config.get("identify_rate", 1),
+            per=identify_per or _startup_config.get("identify_per", 1.0),
+        )
+
+    async def start(self, bot_config):
+        """登录 -> 建立网关会话 -> 等待就绪，记录各阶段耗时；登录失败返回 False"""
+        token = bot_config["token"]
+        remark = bot_config.get("remark", "")
+        client = MyDiscordClient(intents=self.intents, token=token)
+        client.forwarder = self.forwarder
+        async with self._slots:
+            started = time.monotonic()
+            try:
+                await client.login(token)
+            except Exception as e:
+                logger.error(f"❌ {remark} 登录失败: {e} (token: {token[:10]}...)")
+                await client.close()
+                return False
+            logged_in = time.monotonic()
+            self.clients[token] = client
+            self.forwarder.register_client(token, client)
+            self.forwarder.rebuild_routes()
+            await self._identify.acquire("identify")
+            identified = time.monotonic()
+            task = asyncio.create_task(client.connect())
+            self.tasks[token] = task
+            ready = asyncio.create_task(client.wait_until_ready())
+            await asyncio.wait({task, ready}, timeout=BOT_READY_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+            ready.cancel()
+        if client.is_ready():
+            logger.info(
+                f"✅ {remark} 启动完成 (token: {token[:10]}...): 登录 {logged_in - started:.1f}s, "
+                f"排队 {identified - logged_in:.1f}s, 就绪 {time.monotonic() - identified:.1f}s"
+            )
+        else:
+            logger.warning(f"⚠️ {remark} 已登录但 {BOT_READY_TIMEOUT:.0f}s 内未就绪 (token: {token[:10]}...)")
+        return True
+
+    async def _start_tracked(self, bot_config):
+        token = bot_config["token"]
+        self.starting.add(token)
+        self.forwarder.starting += 1
+        try:
+            return await self.start(bot_config)
+        finally:
+            self.starting.discard(token)
+            self.forwarder.starting -= 1
+            self.forwarder.notify_routes()
+
+    async def stop(self, token):
+        client = self.clients.pop(token, None)
+        task = self.tasks.pop(token, None)
+        self.forwarder.unregister_client(token)
+        if client is not None:
+            await client.close()
+            logger.info(f"🛑 机器人已下线 (token: {token[:10]}...)")
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def sync(self, bots):
+        """让运行中的机器人与配置一致，返回 (新增数, 移除数)"""
+        wanted = {b["token"]: b for b in bots if b.get("token")}
+        removed = [token for token in self.clients if token not in wanted]
+        for token in removed:
+            await self.stop(token)
+        if removed:
+            self.forwarder.rebuild_routes()
+        pending = [b for token, b in wanted.items() if token not in self.clients and token not in self.starting]
+        if not pending:
+            return 0, len(removed)
+        started = time.monotonic()
+        results = await asyncio.gather(*(self._start_tracked(b) for b in pending))
+        added = sum(results)
+        logger.info(f"🤖 机器人启动完成: 成功 {added}/{len(pending)}, 用时 {time.monotonic() - started:.1f}s")
+        return added, len(removed)
+
+    def sync_later(self, bots):
+        """在后台同步机器人，调用方（配置热加载）不必等新机器人就绪"""
+        task = asyncio.create_task(self.sync(bots))
+        self._sync_tasks.add(task)
+        task.add_done_callback(self._sync_done)
+        return task
+
+    def _sync_done(self, task):
+        self._sync_tasks.discard(task)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.error(f"❌ 机器人同步失败: {task.exception()}")
+            return
+        added, removed = task.result()
+        if added or removed:
+            logger.info(f"🤖 机器人已同步: 新增 {added}, 移除 {removed}")
+
+    async def wait(self):
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks.values()), return_exceptions=True)
+            # 运行期间可能有新机器人加入，继续等待
+            self.tasks = {t: task for t, task in self.tasks.items() if not task.done()}
+
+    async def close(self):
+        for task in list(self._sync_tasks):
+            task.cancel()
+        await asyncio.gather(*self._sync_tasks, return_exceptions=True)
+        for token in list(self.clients):
+            await self.stop(token)
+
+class ConfigWatcher:
+    """轮询 config.json 的修改时间（POSIX 下也响应 SIGHUP），变更后回调 on_change(new_config)"""
+
+    def __init__(self, path, on_change, interval=2.0):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._trigger = asyncio.Event()
+        self._mtime = self._stat()
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def trigger(self):
+        self._trigger.set()
+
+    def install_signal_handler(self):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self.trigger)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass  # Windows 没有 SIGHUP，仅依赖轮询
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._trigger.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            forced = self._trigger.is_set()
+            self._trigger.clear()
+            mtime = self._stat()
+            if not forced and mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            new_config = load_config()
+            if new_config is None:
+                logger.error("❌ 新配置无法解析，继续使用当前配置")
+                continue
+            try:
+                await self.on_change(new_config)
+            except Exception as e:
+                logger.error(f"❌ 配置热加载失败: {e}")
+
+async def reload_config(new_config, forwarder, manager):
+    """原地应用新配置：同步机器人并重建路由、过滤与翻译设置，不影响监听连接"""
+    if listener_tokens(new_config) != listener_tokens(CONFIG):
+        logger.warning("⚠️ 监听账号 token 已变更，需要重启后生效")
+    # 先用新配置编译路由与分片，任何一步出错都保留当前配置，CONFIG 不会被换成无法使用的内容
+    routes = forwarder.build_routes(new_config)
+    assignment = LISTENERS.plan(new_config["channel_mapping"])
+    CONFIG.clear()
+    CONFIG.update(new_config)
+    # 路由、过滤与翻译设置立即生效；新机器人在后台启动，登录后各自重建路由
+    forwarder.apply_routes(routes)
+    LISTENERS.assignment = assignment
+    manager.sync_later(CONFIG["bots"])
+    logger.info(f"🔄 配置已热加载: 源频道 {len(forwarder.routes)} 个, 机器人在后台同步")
+
 async def main():
     intents = discord.Intents.default()
     intents.message_content = True
@@ -510,47 +3091,59 @@ async def main():
     intents.guild_messages = True
     intents.dm_messages = True
 
-    discord_clients = []
-    tokens = []
-    for bot_config in CONFIG["bots"]:
-        client = MyDiscordClient(intents=intents, token=bot_config["token"])
-        discord_clients.append(client)
-        tokens.append(bot_config["token"])
-
-    forwarder = MessageForwarder(discord_clients)
-    for client in discord_clients:
-        client.forwarder = forwarder
-    selfcord_client = MySelfcordClient(forwarder)
+    forwarder = MessageForwarder([])
+    manager = BotManager(forwarder, intents)
+    for token in listener_tokens(CONFIG):
+        LISTENERS.add(MySelfcordClient(forwarder, token))
 
     logger.info("🚀 启动消息转发系统...")
     logger.info(f"📋 监听频道: {list(CONFIG['channel_mapping'].keys())}")
-    logger.info(f"🎯 目标频道: {list(set(mapping['target'] for mapping in CONFIG['channel_mapping'].values()))}")
+    logger.info(f"🎯 目标频道: {list(set(t['target'] for mapping in CONFIG['channel_mapping'].values() for t in mapping_targets(mapping)))}")
     logger.info(f"🤖 机器人数量: {len(CONFIG['bots'])}")
+    logger.info(f"🧠 启动前内存: {memory_report()}")
 
-    user_id_to_client = {}
-    token_to_user_id = {}
+    # 机器人在后台并发启动，监听账号立即上线；目标机器人未就绪的消息在转发队列中等待
+    forwarder.rebuild_routes()
+    LISTENERS.assign(CONFIG["channel_mapping"])
+    startup_task = asyncio.create_task(manager.sync(CONFIG["bots"]))
 
-    for i, client in enumerate(discord_clients):
+    watcher = ConfigWatcher('config.json', lambda new_config: reload_config(new_config, forwarder, manager))
+    watcher.install_signal_handler()
+    watcher_task = asyncio.create_task(watcher.run())
+    OUTBOX.open()
+    outbox_task = asyncio.create_task(OUTBOX.run())
+    # 同一个数据库文件只用一个连接，检查点与发件箱的写入不会互相锁住
+    same_file = os.path.abspath(CHECKPOINTS.path) == os.path.abspath(OUTBOX.path)
+    CHECKPOINTS.open(OUTBOX.connection if same_file else None)
+    checkpoint_task = asyncio.create_task(CHECKPOINTS.run())
+    if _backfill_config.get("enabled", True):
+        BACKFILLER.hold(forwarder.routes)
+    stats_task = asyncio.create_task(report_stats())
+    metrics_runner = None
+    if METRICS.enabled and _metrics_config.get("port", 9108):
         try:
-            await client.login(tokens[i])
-            user_id = client.user.id
-            user_id_to_client[user_id] = client
-            token_to_user_id[tokens[i]] = user_id
-            logger.info(f"✅ {CONFIG['bots'][i]['remark']} 登录成功 (token: {tokens[i][:10]}...)")
-        except Exception as e:
-            logger.error(f"❌ {CONFIG['bots'][i]['remark']} 登录失败: {e} (token: {tokens[i][:10]}...)")
-        await asyncio.sleep(1)
-
-    forwarder.set_user_id_to_client(user_id_to_client)
-    forwarder.set_token_to_user_id(token_to_user_id)
-
-    bot_tasks = [asyncio.create_task(client.connect()) for client in discord_clients]
-    logger.info("即将启动 selfcord 监听账号...")
+            metrics_runner = await start_metrics_server(_metrics_config.get("host", "127.0.0.1"), _metrics_config.get("port", 9108))
+        except OSError as e:
+            logger.error(f"❌ 指标接口启动失败: {e}")
+    logger.info(f"即将启动 selfcord 监听账号: {len(LISTENERS.listeners)} 个, 分片策略 {LISTENERS.strategy}")
     try:
-        await selfcord_client.start(CONFIG["listener_token"])
-    except Exception as e:
-        logger.error(f"❌ 监听账号登录失败: {e}")
-    await asyncio.gather(*bot_tasks)
+        await asyncio.gather(*(start_selfcord(listener) for listener in LISTENERS.listeners))
+        await asyncio.gather(startup_task, return_exceptions=True)
+        await manager.wait()
+    finally:
+        startup_task.cancel()
+        watcher_task.cancel()
+        checkpoint_task.cancel()
+        CHECKPOINTS.close()
+        outbox_task.cancel()
+        OUTBOX.close()
+        stats_task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await manager.close()
+        await FORWARD_QUEUE.close()
+        await HTTP_POOL.close()
+        TRANSLATION_CACHE.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,45 +1,310 @@
+"""服务器成员导出
 
+按块向网关请求成员列表（REQUEST_GUILD_MEMBERS），每收到一块就直接把原始数据写成 CSV 行，不构建也不缓存 Member 对象，
+因此十万级成员的服务器内存占用也保持平稳。账号没有请求成员列表的权限时，改为按段订阅成员侧边栏（op 14），同样收到即写。web/app.py 通过 EXPORTS 在后台线程中运行导出任务；也可以命令行单独使用：
 
-import selfcord
+    python people.py <token> <服务器ID> [输出文件]
+"""
 import asyncio
 import csv
 import os
+import sys
+import threading
+import time
+import uuid
+
+import selfcord
+
+CSV_HEADER = ["ID", "用户名", "昵称", "Discriminator", "Bot", "加入时间"]
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports")
+
+
+def member_row(member):
+    """把网关成员数据转换为一行 CSV"""
+    user = member.get("user") or {}
+    name = user.get("username", "")
+    discriminator = user.get("discriminator") or "0"
+    # 只拼接非0 discriminator
+    username = f"{name}#{discriminator}" if discriminator != "0" else name
+    display_name = member.get("nick") or user.get("global_name") or name
+    return [user.get("id", ""), username, display_name, discriminator, bool(user.get("bot")), member.get("joined_at") or ""]
+
+
+class ExportJob:
+    """一次导出任务的状态与进度"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    ERROR = "error"
+
+    def __init__(self, guild_id, path):
+        self.id = uuid.uuid4().hex
+        self.guild_id = guild_id
+        self.path = path
+        self.status = self.PENDING
+        self.mode = None  # gateway：网关分块；sidebar：成员侧边栏
+        self.guild_name = ""
+        self.count = 0
+        self.total = None
+        self.chunks = 0
+        self.chunk_count = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.ERROR)
+
+    def progress(self):
+        return {
+            "id": self.id,
+            "guild_id": self.guild_id,
+            "guild_name": self.guild_name,
+            "status": self.status,
+            "mode": self.mode,
+            "count": self.count,
+            "total": self.total,
+            "chunks": self.chunks,
+            "chunk_count": self.chunk_count,
+            "error": self.error,
+            "elapsed": round((self.finished_at or time.time()) - self.created_at, 1),
+        }
+
+
+class MemberExporter(selfcord.Client):
+    """只用于导出的短期会话：不缓存消息与成员，成员分块在解析器中直接写入 CSV"""
+
+    SIDEBAR_STEP = 100  # 侧边栏每段的人数
+
+    def __init__(self, job, writer, chunk_timeout=30.0, first_chunk_timeout=5.0):
+        options = {"max_messages": None, "chunk_guilds_at_startup": False}
+        member_cache_flags = getattr(selfcord, "MemberCacheFlags", None)
+        if member_cache_flags is not None:
+            options["member_cache_flags"] = member_cache_flags.none()
+        try:
+            super().__init__(**options)
+        except TypeError:
+            super().__init__()
+        self.job = job
+        self.writer = writer
+        self.chunk_timeout = chunk_timeout
+        self.first_chunk_timeout = first_chunk_timeout
+        self.nonce = uuid.uuid4().hex[:16]
+        self.done = None
+        self.chunk_arrived = None
+        self._sidebar_seen = None  # 侧边栏模式下已写入的用户ID（各段之间可能有重复）
+        self._install_chunk_hook()
+
+    def _install_chunk_hook(self):
+        parsers = getattr(getattr(self, "_connection", None), "parsers", None)
+        if not parsers or "GUILD_MEMBERS_CHUNK" not in parsers:
+            return
+        original = parsers["GUILD_MEMBERS_CHUNK"]
+
+        def parse_members_chunk(data):
+            if data.get("nonce") != self.nonce:
+                return original(data)
+            for member in data.get("members") or []:
+                self.writer.writerow(member_row(member))
+            self.job.count += len(data.get("members") or [])
+            self.job.chunks += 1
+            self.job.chunk_count = data.get("chunk_count", 1)
+            self.chunk_arrived.set()
+            if data.get("chunk_index", 0) + 1 >= self.job.chunk_count:
+                self.done.set()
 
-TOKEN = "MTIzNTgwNTY3MTc5OTI2MzI3NA.GwD2m8.Y5jE_bCgKsIwlOl8myFVRAKZw-6NOCsulsPZWo"
-GUILD_ID = 1340918593067679799
-OUTPUT_FILE = "guild_members.csv"
-
-class MySelfcordClient(selfcord.Client):
-    async def on_ready(self):
-        print(f'已登录账号: {self.user}')
-        guild = self.get_guild(GUILD_ID)
-        if not guild:
-            print("找不到服务器")
-            await self.close()
+        parsers["GUILD_MEMBERS_CHUNK"] = parse_members_chunk
+        if "GUILD_MEMBER_LIST_UPDATE" not in parsers:
             return
+        original_list = parsers["GUILD_MEMBER_LIST_UPDATE"]
+
+        def parse_member_list_update(data):
+            if self._sidebar_seen is None or str(data.get("guild_id")) != self.job.guild_id:
+                return original_list(data)
+            # 侧边栏模式下自己消费，不交给 selfcord 构建成员对象
+            self._write_sidebar(data)
+
+        parsers["GUILD_MEMBER_LIST_UPDATE"] = parse_member_list_update
+
+    def _write_sidebar(self, data):
+        if data.get("member_count"):
+            self.job.total = data["member_count"]
+        for op in data.get("ops") or []:
+            items = op.get("items") or ([op["item"]] if op.get("item") else [])
+            for item in items:
+                member = item.get("member")
+                user_id = ((member or {}).get("user") or {}).get("id")
+                if user_id is None or user_id in self._sidebar_seen:
+                    continue
+                self._sidebar_seen.add(user_id)
+                self.writer.writerow(member_row(member))
+                self.job.count += 1
+        self.chunk_arrived.set()
+
+    @staticmethod
+    def _can_request_members(guild):
+        """用户账号需要管理身份组、踢出或封禁成员之一的权限才能请求完整成员列表；无法判断时先尝试"""
+        permissions = getattr(getattr(guild, "me", None), "guild_permissions", None)
+        if permissions is None:
+            return True
+        return permissions.manage_roles or permissions.kick_members or permissions.ban_members
+
+    async def export(self):
+        """请求全部成员并等待分块到齐：第一块最多等 first_chunk_timeout 秒，之后每块之间最多等 chunk_timeout 秒"""
+        self.done = asyncio.Event()
+        self.chunk_arrived = asyncio.Event()
+        guild = self.get_guild(int(self.job.guild_id))
+        if guild is None:
+            raise RuntimeError("找不到服务器")
+        self.job.guild_name = guild.name
+        self.job.total = getattr(guild, "member_count", None)
+        request_chunks = getattr(getattr(self, "ws", None), "request_chunks", None)
+        if request_chunks is not None and self._can_request_members(guild):
+            self.job.mode = "gateway"
+            await request_chunks(guild.id, query="", limit=0, nonce=self.nonce)
+            timeout = self.first_chunk_timeout
+            while not self.done.is_set():
+                self.chunk_arrived.clear()
+                try:
+                    await asyncio.wait_for(self.chunk_arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                timeout = self.chunk_timeout
+            if self.job.chunks:
+                return
+        await self._scrape_sidebar(guild)
+
+    async def _scrape_sidebar(self, guild):
+        """没有请求成员列表的权限时，按段订阅某个可见频道的成员侧边栏，每段收到后立即写入；
+        与 Discord 客户端一样，大服务器的侧边栏只列出在线成员"""
+        request = getattr(getattr(self, "ws", None), "request_lazy_guild", None)
+        channels = [c for c in getattr(guild, "text_channels", [])
+                    if guild.me is None or c.permissions_for(guild.me).read_messages]
+        if request is None or not channels:
+            raise RuntimeError("账号无权获取该服务器的成员列表")
+        self.job.mode = "sidebar"
+        self._sidebar_seen = set()
+        step = self.SIDEBAR_STEP
+        start = step
+        while True:
+            # 每次请求固定带上第一段，再加两段新的范围
+            ranges = [[0, step - 1], [start, start + step - 1], [start + step, start + 2 * step - 1]]
+            before = self.job.count
+            self.chunk_arrived.clear()
+            await request(guild.id, channels={channels[0].id: ranges})
+            try:
+                await asyncio.wait_for(self.chunk_arrived.wait(), self.first_chunk_timeout)
+            except asyncio.TimeoutError:
+                break
+            self.job.chunks += 1
+            if self.job.count == before or (self.job.total and start + 2 * step >= self.job.total):
+                break
+            start += 2 * step
+
+
+class ExportService:
+    """在单个后台线程的事件循环中运行导出任务；同一服务器在 cache_ttl 秒内复用已完成的结果"""
+
+    def __init__(self, export_dir=EXPORT_DIR, cache_ttl=3600, concurrency=2, login_timeout=60.0):
+        self.export_dir = export_dir
+        self.cache_ttl = cache_ttl
+        self.login_timeout = login_timeout
+        self.jobs = {}
+        self._latest = {}  # 服务器ID -> 最近一次任务
+        self._lock = threading.Lock()
+        self._loop = None
+        self._slots = None
+        self._concurrency = concurrency
+
+    def _ensure_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name="member-export", daemon=True).start()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def submit(self, token, guild_id, refresh=False):
+        """提交导出任务；同一服务器正在导出或有未过期的结果时直接返回已有任务"""
+        guild_id = str(guild_id).strip()
+        with self._lock:
+            latest = self._latest.get(guild_id)
+            if latest is not None and not refresh:
+                if not latest.finished:
+                    return latest
+                if latest.status == ExportJob.DONE and time.time() - latest.finished_at < self.cache_ttl:
+                    return latest
+            os.makedirs(self.export_dir, exist_ok=True)
+            job = ExportJob(guild_id, os.path.join(self.export_dir, f"{guild_id}-{uuid.uuid4().hex[:8]}.csv"))
+            self.jobs[job.id] = job
+            self._latest[guild_id] = job
+            self._ensure_loop()
+        asyncio.run_coroutine_threadsafe(self._run(job, token), self._loop)
+        return job
+
+    async def _run(self, job, token):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._concurrency)
+        async with self._slots:
+            job.status = ExportJob.RUNNING
+            try:
+                with open(job.path, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(CSV_HEADER)
+                    client = MemberExporter(job, writer)
+                    login = asyncio.create_task(client.start(token))
+                    try:
+                        ready = asyncio.create_task(client.wait_until_ready())
+                        await asyncio.wait({login, ready}, timeout=self.login_timeout, return_when=asyncio.FIRST_COMPLETED)
+                        if not ready.done():
+                            ready.cancel()
+                            if login.done() and login.exception():
+                                raise login.exception()
+                            raise RuntimeError("登录超时")
+                        await client.export()
+                    finally:
+                        await client.close()
+                        login.cancel()
+                job.status = ExportJob.DONE
+            except Exception as e:
+                job.status = ExportJob.ERROR
+                job.error = str(e) or type(e).__name__
+            finally:
+                job.finished_at = time.time()
+                self._prune()
+
+    def _prune(self):
+        """删除过期任务的结果文件，只保留每个服务器最近一次的结果"""
+        with self._lock:
+            for job_id, job in list(self.jobs.items()):
+                if job is self._latest.get(job.guild_id) or not job.finished:
+                    continue
+                del self.jobs[job_id]
+                try:
+                    os.remove(job.path)
+                except OSError:
+                    pass
+
+
+EXPORTS = ExportService()
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    token, guild_id = sys.argv[1], sys.argv[2]
+    output = sys.argv[3] if len(sys.argv) > 3 else "guild_members.csv"
+    service = ExportService(export_dir=os.path.dirname(os.path.abspath(output)))
+    job = ExportJob(guild_id, os.path.abspath(output))
+    asyncio.run(service._run(job, token))
+    if job.status == ExportJob.ERROR:
+        print(f"导出失败: {job.error}")
+        sys.exit(1)
+    print(f"已导出 {job.count} 个成员到 {output} (用时 {job.progress()['elapsed']}s)")
+
 
-        print(f"服务器名称: {guild.name}")
-        print("正在导出已缓存成员...")
-
-        with open(OUTPUT_FILE, "w", newline='', encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["ID", "用户名", "昵称", "Discriminator", "Bot", "加入时间"])
-            for member in guild.members:
-                # 只拼接非0 discriminator
-                if member.discriminator != "0":
-                    username = f"{member.name}#{member.discriminator}"
-                else:
-                    username = member.name
-                writer.writerow([
-                    member.id,
-                    username,
-                    member.display_name,
-                    member.discriminator,
-                    member.bot,
-                    getattr(member, 'joined_at', '')
-                ])
-        print(f"已导出 {len(guild.members)} 个成员到 {OUTPUT_FILE}")
-        os._exit(0)  # 直接退出进程，彻底避免 selfcord 关闭时报错
-
-client = MySelfcordClient()
-asyncio.run(client.start(TOKEN))
\ No newline at end of file
+if __name__ == "__main__":
+    main()
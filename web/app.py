@@ -1,8 +1,15 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
+import csv
 import json
 import os
 import signal
 import subprocess
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from people import EXPORTS
 
 app = Flask(__name__, static_folder='static')
 
@@ -28,105 +35,211 @@ def restart_bot():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+LOG_PATH = os.path.join(os.path.dirname(__file__), '..', 'bot.log')
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+TAIL_BLOCK = 64 * 1024
+# 单次增量读取的上限，避免客户端离线很久后一次拉回整个文件
+MAX_CHUNK = 1024 * 1024
+# 带过滤条件取最后 N 行时最多向前回溯的字节数
+MAX_TAIL_SCAN = 16 * 1024 * 1024
+
+def tail_lines(path, count, match=None):
+    """从文件末尾向前按块读取，返回 (最后 count 条符合 match 的行, 文件末尾偏移)；
+    耗时只与需要回溯的行数有关，与文件大小无关，最多回溯 MAX_TAIL_SCAN 字节"""
+    matched = []
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        carry = b''
+        while count and pos > 0 and len(matched) < count and end - pos < MAX_TAIL_SCAN:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            parts = (f.read(step) + carry).split(b'\n')
+            # 块首的一行可能不完整，留到读取前一块时再拼接
+            carry = parts.pop(0) if pos > 0 else b''
+            for raw in reversed(parts):
+                line = raw.decode('utf-8', errors='replace').rstrip('\r')
+                if line and (match is None or match(line)):
+                    matched.append(line)
+                    if len(matched) >= count:
+                        break
+    matched.reverse()
+    return matched, end
+
+def read_from(path, offset):
+    """读取 offset 之后新增的完整行，返回 (行, 新偏移, 是否重置)；文件被轮转或截断时从头读"""
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        reset = offset > end
+        if reset:
+            offset = 0
+        f.seek(offset)
+        data = f.read(min(end - offset, MAX_CHUNK))
+    # 只返回以换行结尾的完整行，未写完的行留到下次
+    complete = data[:data.rfind(b'\n') + 1]
+    return complete.decode('utf-8', errors='replace').splitlines(), offset + len(complete), reset
+
+def log_filter(args):
+    """按最低级别与频道ID（行内包含即可）过滤日志行"""
+    min_level = LOG_LEVELS.get(args.get('level', '').upper(), 0)
+    channel = args.get('channel', '').strip()
+
+    def match(line):
+        if channel and channel not in line:
+            return False
+        if min_level:
+            # 日志格式：日期 时间 级别 内容
+            parts = line.split(' ', 3)
+            level = LOG_LEVELS.get(parts[2]) if len(parts) > 2 else None
+            # 没有级别的行（如异常堆栈）跟随上一行，保留
+            if level is not None and level < min_level:
+                return False
+        return True
+    return match
+
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
-    log_path = os.path.join(os.path.dirname(__file__), '..', 'bot.log')
+    """不带 offset 时返回最后 lines 行；带 offset 时只返回该偏移之后新增的行"""
+    match = log_filter(request.args)
     try:
-        with open(log_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()[-200:]
-        return jsonify({'logs': ''.join(lines)})
+        if 'offset' in request.args:
+            lines, offset, reset = read_from(LOG_PATH, int(request.args['offset']))
+            lines = [line for line in lines if match(line)]
+        else:
+            # 过滤在回溯时进行：一直向前读到凑满 lines 条符合条件的行
+            lines, offset = tail_lines(LOG_PATH, min(int(request.args.get('lines', 200)), 5000), match)
+            reset = True
+        return jsonify({'logs': '\n'.join(lines), 'offset': offset, 'reset': reset})
     except Exception as e:
-        return jsonify({'logs': f'日志读取失败: {e}'})
+        return jsonify({'logs': f'日志读取失败: {e}', 'offset': 0, 'reset': True})
+
+@app.route('/api/logs/stream', methods=['GET'])
+def stream_logs():
+    """实时日志（Server-Sent Events）：从 offset（默认文件末尾）开始推送新增的行"""
+    match = log_filter(request.args)
+    offset = request.args.get('offset', type=int)
+    if request.headers.get('Last-Event-ID', '').isdigit():
+        # 浏览器自动重连时从上次收到的位置继续，而不是 URL 中最初的偏移
+        offset = int(request.headers['Last-Event-ID'])
+
+    def events():
+        nonlocal offset
+        if offset is None:
+            offset = os.path.getsize(LOG_PATH) if os.path.exists(LOG_PATH) else 0
+        idle = 0.0
+        while True:
+            try:
+                lines, offset, _ = read_from(LOG_PATH, offset)
+            except OSError:
+                lines = []
+            lines = [line for line in lines if match(line)]
+            if lines:
+                idle = 0.0
+                yield f"id: {offset}\n" + ''.join(f"data: {line}\n" for line in lines) + "\n"
+            else:
+                time.sleep(0.5)
+                idle += 0.5
+                # 定期发送注释行，客户端断开时写入失败，生成器随之结束
+                if idle >= 15:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """转发 bot 进程指标接口的 JSON 汇总（地址取自 config.json 的 metrics 段）"""
+    try:
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            metrics_config = json.load(f).get('metrics', {})
+        host = metrics_config.get('host', '127.0.0.1')
+        port = metrics_config.get('port', 9108)
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics.json", timeout=3) as response:
+            return jsonify({'success': True, 'metrics': json.load(response)})
+    except (OSError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'无法连接 bot 指标接口: {e}'})
 
-# 新增：成员信息获取接口
+# 成员导出：任务在 people.EXPORTS 的后台事件循环中运行，这里只负责提交、查询进度与下载
 @app.route('/api/people', methods=['POST'])
 def export_people():
-    try:
-        data = request.json
-        token = data.get('token')
-        guild_id = data.get('guild_id')
-        
-        if not token or not guild_id:
-            return jsonify({'success': False, 'error': 'Token和服务器ID不能为空'})
-        
-        # 创建临时脚本
-        script_content = f'''import selfcord
-import asyncio
-import csv
-import os
+    """提交成员导出任务；同一服务器正在导出或结果未过期时返回已有任务"""
+    data = request.json or {}
+    token = (data.get('token') or '').strip()
+    guild_id = str(data.get('guild_id') or '').strip()
+    if not token or not guild_id:
+        return jsonify({'success': False, 'error': 'Token和服务器ID不能为空'})
+    if not guild_id.isdigit():
+        return jsonify({'success': False, 'error': '服务器ID格式不正确'})
+    job = EXPORTS.submit(token, guild_id, refresh=bool(data.get('refresh')))
+    return jsonify({'success': True, 'job': job.progress()})
 
-TOKEN = "{token}"
-GUILD_ID = {guild_id}
-OUTPUT_FILE = "guild_members.csv"
-
-class MySelfcordClient(selfcord.Client):
-    async def on_ready(self):
-        print(f'已登录账号: {{self.user}}')
-        guild = self.get_guild(GUILD_ID)
-        if not guild:
-            print("找不到服务器")
-            await self.close()
-            return
-
-        print(f"服务器名称: {{guild.name}}")
-        print("正在导出已缓存成员...")
-
-        with open(OUTPUT_FILE, "w", newline='', encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["ID", "用户名", "昵称", "Discriminator", "Bot", "加入时间"])
-            for member in guild.members:
-                # 只拼接非0 discriminator
-                if member.discriminator != "0":
-                    username = f"{{member.name}}#{{member.discriminator}}"
-                else:
-                    username = member.name
-                writer.writerow([
-                    member.id,
-                    username,
-                    member.display_name,
-                    member.discriminator,
-                    member.bot,
-                    getattr(member, 'joined_at', '')
-                ])
-        print(f"已导出 {{len(guild.members)}} 个成员到 {{OUTPUT_FILE}}")
-        os._exit(0)
-
-client = MySelfcordClient()
-asyncio.run(client.start(TOKEN))
-'''
-        
-        # 写入临时脚本
-        temp_script_path = os.path.join(os.path.dirname(__file__), '..', 'temp_people.py')
-        with open(temp_script_path, 'w', encoding='utf-8') as f:
-            f.write(script_content)
-        
-        # 执行脚本
-        result = subprocess.run(['python', temp_script_path], 
-                              capture_output=True, text=True, timeout=30)
-        
-        # 删除临时脚本
-        os.remove(temp_script_path)
-        
-        if result.returncode == 0:
-            # 读取生成的CSV文件
-            csv_path = os.path.join(os.path.dirname(__file__), '..', 'guild_members.csv')
-            if os.path.exists(csv_path):
-                with open(csv_path, 'r', encoding='utf-8') as f:
-                    csv_content = f.read()
-                return jsonify({
-                    'success': True, 
-                    'message': result.stdout,
-                    'csv_content': csv_content
-                })
-            else:
-                return jsonify({'success': False, 'error': 'CSV文件生成失败'})
-        else:
-            return jsonify({'success': False, 'error': result.stderr})
-            
-    except subprocess.TimeoutExpired:
-        return jsonify({'success': False, 'error': '执行超时'})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+def export_job(job_id):
+    job = EXPORTS.get(job_id)
+    if job is None:
+        return None, (jsonify({'success': False, 'error': '任务不存在或已过期'}), 404)
+    return job, None
+
+@app.route('/api/people/<job_id>', methods=['GET'])
+def export_progress(job_id):
+    job, error = export_job(job_id)
+    if error:
+        return error
+    return jsonify({'success': True, 'job': job.progress()})
+
+@app.route('/api/people/<job_id>/preview', methods=['GET'])
+def export_preview(job_id):
+    """读取已写入的前 limit 行用于页面预览，不加载整个文件"""
+    job, error = export_job(job_id)
+    if error:
+        return error
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    rows = []
+    if os.path.exists(job.path):
+        with open(job.path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(rows) >= limit:
+                    break
+                rows.append(row)
+    return jsonify({'success': True, 'rows': rows, 'job': job.progress()})
+
+@app.route('/api/people/<job_id>/csv', methods=['GET'])
+def export_download(job_id):
+    """分块发送 CSV；任务仍在进行时跟随文件增长继续发送，直到导出结束"""
+    job, error = export_job(job_id)
+    if error:
+        return error
+
+    def chunks():
+        offset = 0
+        while True:
+            finished = job.finished
+            if os.path.exists(job.path):
+                with open(job.path, 'rb') as f:
+                    f.seek(offset)
+                    while True:
+                        data = f.read(MAX_CHUNK)
+                        if not data:
+                            break
+                        if not finished:
+                            # 未结束时只发送完整的行，避免把写了一半的行发出去
+                            cut = data.rfind(b'\n') + 1
+                            data = data[:cut]
+                            if not data:
+                                break
+                        offset += len(data)
+                        yield data
+            if finished:
+                return
+            time.sleep(0.5)
+
+    filename = f"guild_members_{job.guild_id}.csv"
+    return Response(chunks(), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')